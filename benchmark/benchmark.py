@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+import time
+import shutil
+import tempfile
+import platform
+import resource
+import statistics
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from window_watcher import list_windows
+from matcher import compile_matcher
+from audio import AudioBackend
+from modes import build_switch_plan
+from settings import Settings
+from transition import TransitionRunner
+from scheduler import AdaptiveScheduler
+
+BIGPICTURE_WINDOW = "0x0bb00001  0 steamwebhelper.steam  bench Steam Big Picture Mode"
+DEFAULT_KEYWORDS = ["Steam", "Big", "Picture", "Mode"]
+
+WMCTRL_STUB = """#!/bin/sh
+echo wmctrl >> "{state}/forks"
+sleep {latency}
+[ -f "{state}/bigpicture" ] && echo "{bigpicture}"
+cat "{state}/windows"
+"""
+
+PACTL_STUB = """#!/bin/sh
+echo pactl >> "{state}/forks"
+case "$1" in
+    list) sleep {latency}; cat "{state}/sinks" ;;
+    subscribe) exec sleep 86400 ;;
+    *) sleep {latency} ;;
+esac
+"""
+
+XRANDR_STUB = """#!/bin/sh
+echo xrandr >> "{state}/forks"
+sleep {latency}
+"""
+
+
+def write_stub(bin_dir, name, content):
+    path = os.path.join(bin_dir, name)
+    with open(path, 'w') as f:
+        f.write(content)
+    os.chmod(path, 0o755)
+
+
+def create_stubs(state_dir, args):
+    bin_dir = os.path.join(state_dir, 'bin')
+    os.makedirs(bin_dir)
+    write_stub(bin_dir, 'wmctrl', WMCTRL_STUB.format(state=state_dir, latency=args.wmctrl_latency, bigpicture=BIGPICTURE_WINDOW))
+    write_stub(bin_dir, 'pactl', PACTL_STUB.format(state=state_dir, latency=args.pactl_latency))
+    write_stub(bin_dir, 'xrandr', XRANDR_STUB.format(state=state_dir, latency=args.xrandr_latency))
+
+    with open(os.path.join(state_dir, 'windows'), 'w') as f:
+        for i in range(args.windows):
+            f.write(f"0x{0x04000001 + i:08x}  0 app{i}.App{i}  bench Window {i} - Application\n")
+
+    with open(os.path.join(state_dir, 'sinks'), 'w') as f:
+        for i in range(args.sinks):
+            f.write(f"Sink #{i}\n\tName: bench_sink_{i}\n\tProperties:\n\t\tdevice.description = \"Bench Sink {i}\"\n\n")
+
+    return bin_dir
+
+
+def count_forks(state_dir):
+    forks = {}
+    path = os.path.join(state_dir, 'forks')
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                forks[line.strip()] = forks.get(line.strip(), 0) + 1
+    return forks
+
+
+def distribution(samples):
+    if not samples:
+        return None
+    samples = sorted(samples)
+
+    def percentile(p):
+        return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+    return {
+        "count": len(samples),
+        "min": samples[0],
+        "mean": statistics.fmean(samples),
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "max": samples[-1],
+    }
+
+
+def cpu_time():
+    # getrusage has microsecond resolution, os.times() only counts 10ms clock ticks.
+    total = 0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def detect(matcher):
+    return matcher.match_any(list_windows())
+
+
+def bench_ticks(state_dir, matcher, args):
+    cpu_samples = []
+    wall_samples = []
+    for _ in range(args.ticks):
+        cpu_start = cpu_time()
+        wall_start = time.perf_counter()
+        detect(matcher)
+        wall_samples.append((time.perf_counter() - wall_start) * 1000)
+        cpu_samples.append((cpu_time() - cpu_start) * 1000)
+
+    forks = count_forks(state_dir)
+    forks_per_tick = sum(forks.values()) / args.ticks
+    return {
+        "tick_cpu_ms": distribution(cpu_samples),
+        "tick_wall_ms": distribution(wall_samples),
+        "forks_per_tick": forks_per_tick,
+        # Only what polling at a fixed check rate would cost, see bench_polling for the real rate.
+        "forks_per_minute_fixed_rate": forks_per_tick * 60000 / args.check_rate,
+        "forks_by_tool": forks,
+    }
+
+
+def bench_polling(state_dir, matcher, args):
+    """Forks over a wall-clock window, polling when the adaptive scheduler says so."""
+    scheduler = AdaptiveScheduler(args.check_rate / 1000, args.idle_check_rate / 1000)
+    forks_before = sum(count_forks(state_dir).values())
+    ticks = 0
+    previous_windows = None
+    start = time.monotonic()
+    end = start + args.window
+    while True:
+        time.sleep(max(0, min(scheduler.timeout(), end - time.monotonic())))
+        if time.monotonic() >= end:
+            break
+        windows = list_windows()
+        if windows != previous_windows:
+            # The controller polls faster again whenever the window list changes.
+            scheduler.trigger("window list changed")
+            previous_windows = windows
+        matcher.match(windows)
+        scheduler.schedule()
+        ticks += 1
+    elapsed = time.monotonic() - start
+    forks = sum(count_forks(state_dir).values()) - forks_before
+    return {
+        "window_seconds": elapsed,
+        "ticks": ticks,
+        "forks": forks,
+        "forks_per_minute": forks * 60 / elapsed,
+    }
+
+
+def bench_switches(state_dir, matcher, args):
+    settings = Settings(
+        bigPictureKeywords=args.keywords,
+        checkRate=args.check_rate,
+        gamemodeAudio=f"Bench Sink {args.sinks - 1}",
+        desktopAudio="Bench Sink 0",
+        gamemodeAdapter="HDMI-1",
+        desktopAdapter="eDP-1",
+        disableAudio=args.sinks == 0,
+        displayBackend="command",
+    )
+    audio_backend = AudioBackend()
+    switch_plan = build_switch_plan(settings, audio_backend)
+    if not settings.disableAudio:
+        audio_backend.start()
+    runner = TransitionRunner(lambda transition: None)
+
+    bigpicture_flag = os.path.join(state_dir, 'bigpicture')
+    detect_samples = []
+    switch_samples = []
+    total_samples = []
+    steps = {}
+    for i in range(args.switches):
+        entering = i % 2 == 0
+        if entering:
+            open(bigpicture_flag, 'w').close()
+        else:
+            os.remove(bigpicture_flag)
+        changed_at = time.monotonic()
+
+        # Poll like the fallback timer would until the change is seen.
+        while detect(matcher) != entering:
+            time.sleep(args.check_rate / 1000)
+        detected_at = time.monotonic()
+
+        mode, previous_mode = (switch_plan.gamemode, switch_plan.desktopmode) if entering else (switch_plan.desktopmode, switch_plan.gamemode)
+        transition = runner.start(mode, previous_mode, detected_at)
+        transition.done.wait()
+        done_at = time.monotonic()
+
+        detect_samples.append((detected_at - changed_at) * 1000)
+        switch_samples.append((done_at - detected_at) * 1000)
+        total_samples.append((done_at - changed_at) * 1000)
+        for step, elapsed in transition.timings.items():
+            steps.setdefault(step, []).append(elapsed * 1000)
+
+    runner.shutdown()
+    audio_backend.stop()
+    return {
+        "detect_latency_ms": distribution(detect_samples),
+        "switch_latency_ms": distribution(switch_samples),
+        "detect_to_switch_ms": distribution(total_samples),
+        "transition_steps_ms": {step: distribution(samples) for step, samples in steps.items()},
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark BigPictureTV detection and switching against stub tools.")
+    parser.add_argument('--windows', type=int, default=20, help="number of simulated windows")
+    parser.add_argument('--sinks', type=int, default=4, help="number of simulated audio sinks, 0 disables audio")
+    parser.add_argument('--ticks', type=int, default=200, help="detection ticks to measure")
+    parser.add_argument('--switches', type=int, default=10, help="mode switches to measure")
+    parser.add_argument('--check-rate', type=int, default=100, help="polling interval in ms")
+    parser.add_argument('--idle-check-rate', type=int, default=Settings.idleCheckRate, help="longest polling interval in ms")
+    parser.add_argument('--window', type=float, default=30, help="seconds of adaptive polling to count forks over")
+    parser.add_argument('--wmctrl-latency', type=float, default=0.0, help="seconds the wmctrl stub takes")
+    parser.add_argument('--pactl-latency', type=float, default=0.0, help="seconds the pactl stub takes")
+    parser.add_argument('--xrandr-latency', type=float, default=0.2, help="seconds the xrandr stub takes")
+    parser.add_argument('--keywords', nargs='+', default=DEFAULT_KEYWORDS, help="detection keywords")
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    state_dir = tempfile.mkdtemp(prefix='bigpicturetv-bench-')
+    try:
+        bin_dir = create_stubs(state_dir, args)
+        os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+        os.environ["XDG_SESSION_TYPE"] = "x11"
+
+        matcher = compile_matcher([args.keywords])
+        report = {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "parameters": {key: value for key, value in vars(args).items() if key != 'output'},
+            "detection": bench_ticks(state_dir, matcher, args),
+            "polling": bench_polling(state_dir, matcher, args),
+            "switching": bench_switches(state_dir, matcher, args),
+        }
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+import re
+import queue
+import threading
+import time
+import logging
+from commands import runner, CommandError
+from recorder import recorder
+from metrics import metrics
+
+try:
+    import pulsectl
+except (ImportError, OSError):
+    # OSError when the module is there but libpulse is not.
+    pulsectl = None
+
+logger = logging.getLogger(__name__)
+
+SINK_EVENT_PATTERN = re.compile(r"Event '(new|remove)' on sink #")
+POLL_INTERVAL = 0.5
+DEFAULT_SINK_PATTERN = re.compile(r'^Default Sink: (.*)$', re.MULTILINE)
+SINK_INPUT_PATTERN = re.compile(r'^Sink Input #(\d+)', re.MULTILINE)
+APP_PROPERTIES = ('application.name', 'application.process.binary')
+PULSE_CALL_TIMEOUT = 5
+PULSE_WAKE_INTERVAL = 0.05
+
+
+def list_sinks():
+    output = runner.run(['pactl', 'list', 'sinks'], retries=2)
+    sinks = {}
+    for sink in output.split('\n\n'):
+        name = re.search(r'Name: (.*)', sink)
+        description = re.search(r'device\.description = "(.*)"', sink)
+        if name:
+            sinks[description.group(1) if description else name.group(1)] = name.group(1).strip()
+    return sinks
+
+
+def matches_apps(properties, apps):
+    if not apps:
+        return True
+    values = [properties.get(key, '').lower() for key in APP_PROPERTIES]
+    return any(app.lower() in value for app in apps for value in values if value)
+
+
+def list_sink_inputs():
+    output = runner.run(['pactl', 'list', 'sink-inputs'], retries=1)
+    streams = []
+    for block in output.split('\n\n'):
+        index = SINK_INPUT_PATTERN.search(block)
+        sink = re.search(r'^\s*Sink: (\d+)$', block, re.MULTILINE)
+        if index:
+            properties = dict(re.findall(r'^\s*([\w.]+) = "(.*)"$', block, re.MULTILINE))
+            streams.append((index.group(1), sink.group(1) if sink else None, properties))
+    return streams
+
+
+def get_sink_index(node_name):
+    for line in runner.run(['pactl', 'list', 'short', 'sinks']).splitlines():
+        columns = line.split('\t')
+        if len(columns) > 1 and columns[1] == node_name:
+            return columns[0]
+    return None
+
+
+def move_sink_inputs(node_name, apps):
+    """Moves the playing streams to node_name with pactl, returns how many were moved.
+
+    pactl moves one stream per call, the calls run a few at a time.
+    """
+    sink_index = get_sink_index(node_name)
+    streams = [index for index, sink, properties in list_sink_inputs() if sink != sink_index and matches_apps(properties, apps)]
+    errors = []
+
+    def move(index):
+        try:
+            runner.run(['pactl', 'move-sink-input', index, node_name])
+        except CommandError as e:
+            errors.append(e)
+
+    # The runner limits how many run at once. Daemon threads, so a hung
+    # audio server does not hold up exit.
+    threads = [threading.Thread(target=move, args=(index,), daemon=True) for index in streams]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return len(streams)
+
+
+def list_pulse_sinks(pulse):
+    return {sink.description or sink.name: sink.name for sink in pulse.sink_list()}
+
+
+def move_pulse_sink_inputs(pulse, node_name, apps):
+    sink = pulse.get_sink_by_name(node_name)
+    streams = [stream for stream in pulse.sink_input_list() if stream.sink != sink.index and matches_apps(stream.proplist, apps)]
+    for stream in streams:
+        pulse.sink_input_move(stream.index, sink.index)
+    return len(streams)
+
+
+class PulseRequest:
+    def __init__(self, function):
+        self.function = function
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class PulseConnection:
+    """One pulsectl connection, owned by its own thread.
+
+    pulsectl cannot run operations while it listens for events, so the
+    thread listens for sink events and runs the calls of other threads in
+    between, stopping the listen loop for them. Errors are raised as
+    CommandError, like a failed pactl call.
+    """
+
+    def __init__(self, on_sinks_changed):
+        self.on_sinks_changed = on_sinks_changed
+        self.requests = queue.Queue()
+        self.sinks_changed = False
+        self.stopping = False
+        self.closed = False
+        # Guards the loop wakeups against the connection being freed.
+        self.lock = threading.Lock()
+        try:
+            self.pulse = pulsectl.Pulse('BigPictureTV')
+            self.pulse.event_mask_set('sink')
+        except (pulsectl.PulseError, pulsectl.PulseDisconnected) as e:
+            raise CommandError(f"audio server: {e}")
+        self.pulse.event_callback_set(self.on_event)
+        self.thread = threading.Thread(target=self.run, name='pulse', daemon=True)
+        self.thread.start()
+
+    def is_running(self):
+        return not self.stopping and not self.closed
+
+    def on_event(self, event):
+        if event.t in ('new', 'remove'):
+            self.sinks_changed = True
+            raise pulsectl.PulseLoopStop
+
+    def run(self):
+        try:
+            while not self.stopping:
+                self.run_requests()
+                if self.sinks_changed:
+                    self.sinks_changed = False
+                    self.on_sinks_changed()
+                self.pulse.event_listen()
+        except (pulsectl.PulseError, pulsectl.PulseDisconnected) as e:
+            if not self.stopping:
+                logger.warning("Lost connection to the audio server: %s", e)
+        finally:
+            with self.lock:
+                self.closed = True
+                self.run_requests()
+                self.pulse.close()
+
+    def run_requests(self):
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                return
+            if self.closed:
+                request.error = CommandError("audio server connection closed")
+            else:
+                try:
+                    request.result = request.function(self.pulse)
+                except (pulsectl.PulseError, pulsectl.PulseDisconnected) as e:
+                    request.error = CommandError(f"audio server: {e}")
+            request.done.set()
+
+    def call(self, function, timeout=PULSE_CALL_TIMEOUT):
+        """Runs function(pulse) on the connection thread and returns its result."""
+        if threading.current_thread() is self.thread:
+            try:
+                return function(self.pulse)
+            except (pulsectl.PulseError, pulsectl.PulseDisconnected) as e:
+                raise CommandError(f"audio server: {e}")
+        if self.closed:
+            raise CommandError("audio server connection closed")
+        request = PulseRequest(function)
+        self.requests.put(request)
+        deadline = time.monotonic() + timeout
+        # Stopping the loop is racy in pulsectl, it is repeated until the call ran.
+        while True:
+            self.wake()
+            if request.done.wait(PULSE_WAKE_INTERVAL) or (self.closed and self.requests.empty()):
+                break
+            if time.monotonic() > deadline:
+                raise CommandError(f"audio server did not answer within {timeout}s")
+        if not request.done.is_set():
+            raise CommandError("audio server connection closed")
+        if request.error:
+            raise request.error
+        return request.result
+
+    def wake(self):
+        with self.lock:
+            if not self.closed:
+                self.pulse.event_listen_stop()
+
+    def close(self):
+        self.stopping = True
+        if self.thread is not threading.current_thread():
+            self.wake()
+
+
+class AudioBackend:
+    """Keeps the sink list cached from a single audio server connection.
+
+    With pulsectl, listing sinks, switching the default sink and moving
+    streams all go over one persistent connection, which also reports
+    sinks being added or removed. Without it, `pactl subscribe` reports
+    them and each operation is a pactl call. Either way the sink list is
+    only re-read when a sink comes or goes.
+    """
+
+    def __init__(self):
+        self.sinks = {}
+        self.connection = None
+        self.subscriber = None
+        self.condition = threading.Condition()
+
+    def get_connection(self):
+        connection = self.connection
+        return connection if connection is not None and connection.is_running() else None
+
+    def is_running(self):
+        return self.get_connection() is not None or (self.subscriber is not None and self.subscriber.poll() is None)
+
+    def start(self):
+        if self.is_running():
+            return True
+        if pulsectl is not None:
+            try:
+                self.connection = PulseConnection(self.refresh)
+                self.refresh()
+                return True
+            except CommandError as e:
+                logger.warning("Cannot connect with pulsectl, using pactl: %s", e)
+                self.connection = None
+        if runner.which('pactl') is None:
+            return False
+
+        self.subscriber = runner.spawn(['pactl', 'subscribe'])
+        threading.Thread(target=self.read_events, args=(self.subscriber,), daemon=True).start()
+        self.refresh()
+        return True
+
+    def stop(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+        if self.subscriber is not None and self.subscriber.poll() is None:
+            self.subscriber.terminate()
+        self.subscriber = None
+
+    def read_events(self, process):
+        for line in process.stdout:
+            if SINK_EVENT_PATTERN.search(line):
+                self.refresh()
+        if process is self.subscriber:
+            logger.warning("Lost connection to the audio server, sink list will be polled.")
+            self.subscriber = None
+
+    def refresh(self):
+        connection = self.get_connection()
+        try:
+            sinks = connection.call(list_pulse_sinks) if connection else list_sinks()
+        except CommandError as e:
+            # Keep the last known sinks, the audio server may just be restarting.
+            logger.warning("Cannot list audio sinks: %s", e)
+            return
+        recorder.record_sinks(sinks)
+        with self.condition:
+            self.sinks = sinks
+            self.condition.notify_all()
+
+    def find_sink(self, audio):
+        with self.condition:
+            if audio in self.sinks:
+                return self.sinks[audio]
+            for description, name in self.sinks.items():
+                if audio in description or audio in name:
+                    return name
+        return None
+
+    def wait_for_sink(self, audio, timeout, cancelled=None):
+        self.start()
+        is_cancelled = cancelled.is_set if cancelled else lambda: False
+        with self.condition:
+            if self.is_running():
+                self.condition.wait_for(lambda: is_cancelled() or self.find_sink(audio) is not None, timeout)
+                return None if is_cancelled() else self.find_sink(audio)
+
+        waited = 0
+        while waited < timeout and not is_cancelled():
+            self.refresh()
+            node_name = self.find_sink(audio)
+            if node_name:
+                return node_name
+            time.sleep(POLL_INTERVAL)
+            waited += POLL_INTERVAL
+        return None
+
+    def wake(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def get_default_sink(self):
+        connection = self.get_connection()
+        try:
+            if connection:
+                return connection.call(lambda pulse: pulse.server_info().default_sink_name)
+            match = DEFAULT_SINK_PATTERN.search(runner.run(['pactl', 'info'], retries=1))
+        except CommandError as e:
+            logger.warning("Cannot read the default audio output: %s", e)
+            return None
+        return match.group(1).strip() if match else None
+
+    def set_default_sink(self, node_name):
+        connection = self.get_connection()
+        try:
+            if connection:
+                connection.call(lambda pulse: pulse.sink_default_set(node_name))
+            else:
+                runner.run(['pactl', 'set-default-sink', node_name], retries=2)
+        except CommandError as e:
+            logger.error("Cannot switch audio: %s", e)
+
+    def move_streams(self, node_name, apps=None):
+        connection = self.get_connection()
+        start = time.monotonic()
+        try:
+            if connection:
+                moved = connection.call(lambda pulse: move_pulse_sink_inputs(pulse, node_name, apps))
+            else:
+                moved = move_sink_inputs(node_name, apps)
+        except CommandError as e:
+            logger.error("Cannot move audio streams: %s", e)
+            metrics.increment('failures_total', kind='audio_streams')
+            return
+        elapsed = time.monotonic() - start
+        metrics.observe('audio_migration_seconds', elapsed)
+        if moved:
+            logger.info("Moved %d audio streams to %s in %.0fms", moved, node_name, elapsed * 1000)
@@ -0,0 +1,108 @@
+import os
+import time
+import shutil
+import subprocess
+import threading
+import logging
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BUNDLED_TOOLS = {'gnome-randr'}
+DEFAULT_TIMEOUT = 10
+TOOL_TIMEOUTS = {
+    'wmctrl': 2,
+    'pactl': 5,
+    'xrandr': 10,
+    'gnome-randr': 15,
+    'kscreen-doctor': 15,
+}
+MAX_CONCURRENT = 4
+RETRY_DELAY = 0.2
+
+
+class CommandError(Exception):
+    pass
+
+
+class CommandRunner:
+    """Every external tool is started from here.
+
+    Tool paths are resolved once, each tool has its own timeout, at most
+    MAX_CONCURRENT commands run at the same time and failed calls can be
+    retried with an exponential backoff. stderr is captured so failures
+    are logged with the tool's own message.
+    """
+
+    def __init__(self):
+        self.paths = {}
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(MAX_CONCURRENT)
+
+    def which(self, tool):
+        with self.lock:
+            if tool in self.paths:
+                return self.paths[tool]
+        if tool in BUNDLED_TOOLS:
+            path = os.path.join(SCRIPT_DIR, tool)
+            if not os.access(path, os.X_OK):
+                path = None
+        else:
+            path = shutil.which(tool)
+        if path:
+            # Missing tools are looked up again, they may be installed later.
+            with self.lock:
+                self.paths[tool] = path
+        return path
+
+    def resolve(self, command):
+        tool = os.path.basename(command[0])
+        path = command[0] if os.path.isabs(command[0]) else self.which(tool)
+        if path is None:
+            metrics.increment('command_failures_total', tool=tool, reason='missing')
+            raise CommandError(f"{tool} is not installed")
+        return tool, [path] + list(command[1:])
+
+    def run(self, command, retries=0, timeout=None):
+        """Runs a command to completion and returns its stdout as text."""
+        tool, argv = self.resolve(command)
+        timeout = timeout or TOOL_TIMEOUTS.get(tool, DEFAULT_TIMEOUT)
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+            try:
+                return self.run_once(tool, argv, timeout)
+            except CommandError as e:
+                error = e
+                logger.warning("%s%s", e, ", retrying" if attempt < retries else "")
+        raise error
+
+    def run_once(self, tool, argv, timeout):
+        with self.slots:
+            metrics.increment('forks_total', tool=tool)
+            start = time.monotonic()
+            try:
+                result = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                metrics.increment('command_failures_total', tool=tool, reason='timeout')
+                raise CommandError(f"{tool} timed out after {timeout}s")
+            except OSError as e:
+                metrics.increment('command_failures_total', tool=tool, reason='error')
+                raise CommandError(f"{tool} could not be started: {e}")
+            finally:
+                metrics.observe('command_duration_seconds', time.monotonic() - start, tool=tool)
+        if result.returncode != 0:
+            metrics.increment('command_failures_total', tool=tool, reason='exit')
+            stderr = result.stderr.decode('utf-8', errors='replace').strip()
+            raise CommandError(f"{tool} exited with {result.returncode}: {stderr or 'no error output'}")
+        return result.stdout.decode('utf-8', errors='replace')
+
+    def spawn(self, command):
+        """Starts a long running event stream, its stdout is read line by line."""
+        tool, argv = self.resolve(command)
+        metrics.increment('forks_total', tool=tool)
+        return subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+
+
+runner = CommandRunner()
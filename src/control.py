@@ -0,0 +1,183 @@
+import os
+import fcntl
+import socket
+import tempfile
+import threading
+import logging
+from modes import GAME_MODE_NAME, DESKTOP_MODE_NAME
+from settings import load_settings
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SOCKET_NAME = "bigpicturetv.sock"
+COMMAND_TIMEOUT = 2
+
+
+class AlreadyRunningError(Exception):
+    pass
+
+
+def get_socket_path():
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, SOCKET_NAME)
+    return os.path.join(tempfile.gettempdir(), f"bigpicturetv-{os.getuid()}.sock")
+
+
+def send_command(command, timeout=COMMAND_TIMEOUT):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(get_socket_path())
+        client.sendall(command.encode('utf-8') + b'\n')
+        client.shutdown(socket.SHUT_WR)
+        reply = b''
+        while True:
+            chunk = client.recv(4096)
+            if not chunk:
+                break
+            reply += chunk
+    return reply.decode('utf-8').strip()
+
+
+def is_running():
+    try:
+        send_command('ping')
+        return True
+    except OSError:
+        return False
+
+
+def main(command):
+    """Sends command to the running instance and prints the reply."""
+    try:
+        reply = send_command(command)
+    except OSError as e:
+        logger.error("BigPictureTV is not running (%s)", e)
+        return 1
+    print(reply)
+    return 1 if reply.startswith(('error:', 'unknown')) else 0
+
+
+class CommandHandler:
+    """Commands of the running instance, daemon or tray.
+
+    Called from the control thread, show_settings and quit have to hand
+    over to their own thread.
+    """
+
+    def __init__(self, controller, show_settings, quit):
+        self.controller = controller
+        self.show_settings = show_settings
+        self.quit = quit
+
+    def __call__(self, command):
+        name, _, argument = command.partition(' ')
+        argument = argument.strip()
+        if name == 'ping':
+            return 'pong'
+        elif name == 'status':
+            return '\n'.join(f"{key}: {value}" for key, value in self.controller.status().items())
+        elif name == 'enter-game':
+            mode_name = argument or GAME_MODE_NAME
+            if mode_name == DESKTOP_MODE_NAME or not self.controller.has_mode(mode_name):
+                return f"unknown profile: {mode_name}"
+            self.controller.enter_mode(mode_name)
+            return 'ok'
+        elif name == 'enter-desktop':
+            if argument:
+                return "error: enter-desktop takes no profile"
+            self.controller.enter_mode(DESKTOP_MODE_NAME)
+            return 'ok'
+        elif name in ('pause', 'resume'):
+            self.controller.set_detection_active(name == 'resume')
+            return 'ok'
+        elif name == 'reload':
+            self.controller.update_settings(load_settings())
+            return 'ok'
+        elif command == 'metrics':
+            return metrics.to_prometheus()
+        elif command == 'metrics json':
+            return metrics.to_json()
+        elif name == 'settings':
+            self.show_settings()
+            return 'ok'
+        elif name == 'quit':
+            self.quit()
+            return 'ok'
+        return f"unknown command: {command}"
+
+
+class ControlServer:
+    """Line based command socket of the running instance.
+
+    Whoever holds the lock next to the socket is the running instance, so a
+    socket left behind by a crash never blocks the next start.
+    """
+
+    def __init__(self, handler=None):
+        self.handler = handler
+        self.path = get_socket_path()
+        self.lock_fd = None
+        self.server = None
+
+    def acquire(self):
+        # Without XDG_RUNTIME_DIR this is in a shared /tmp, never follow a planted symlink.
+        lock_fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock_fd)
+            raise AlreadyRunningError(f"{self.path} is owned by another instance")
+        self.lock_fd = lock_fd
+        if os.path.exists(self.path):
+            # Left behind by an instance that did not exit cleanly.
+            os.unlink(self.path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.server.listen()
+
+    def start(self):
+        if self.server is None:
+            self.acquire()
+        threading.Thread(target=self.serve, name='control', daemon=True).start()
+
+    def stop(self):
+        if self.server:
+            self.server.close()
+            self.server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+    def serve(self):
+        server = self.server
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+
+    def handle(self, connection):
+        with connection:
+            connection.settimeout(COMMAND_TIMEOUT)
+            try:
+                request = b''
+                while b'\n' not in request:
+                    chunk = connection.recv(4096)
+                    if not chunk:
+                        break
+                    request += chunk
+                command = request.decode('utf-8').strip()
+                try:
+                    reply = self.handler(command)
+                except Exception as e:
+                    logger.exception("Control command failed: %s", command)
+                    reply = f"error: {e}"
+                connection.sendall(reply.encode('utf-8') + b'\n')
+            except OSError as e:
+                logger.warning("Control connection failed: %s", e)
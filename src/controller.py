@@ -0,0 +1,413 @@
+import os
+import time
+import queue
+import threading
+import logging
+from window_watcher import WindowWatcher, list_windows
+from audio import AudioBackend
+from modes import build_switch_plan, DESKTOP_MODE_NAME
+from transition import TransitionRunner
+from matcher import compile_matcher
+from scheduler import AdaptiveScheduler
+from session_monitor import SessionMonitor
+from process_detector import ProcessDetector, STEAM_PID_FILE
+from topology import TopologyCache
+from mode_state import ModeStateMachine, SWITCH, CANCEL
+from metrics import metrics
+from recorder import recorder
+import journal
+
+logger = logging.getLogger(__name__)
+
+SHUTDOWN_TIMEOUT = 5
+
+
+class Controller:
+    """Detection and switching, without any Qt dependency.
+
+    Every event (window changes, finished transitions, settings updates, poll
+    ticks) is handled on the controller thread, so the state below is only
+    touched from there. Listeners are called from that thread too, only when
+    the active mode or the detection state changed.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.detection_active = True
+        self.listeners = []
+        self.notified_state = None
+        self.events = queue.Queue()
+        self.thread = None
+        self.switch_plan = None
+        self.switch_plan_stale = True
+        self.deferred_mode = None
+        self.requested_mode = None
+        self.window_matcher = None
+        self.scheduler = AdaptiveScheduler(*self.get_check_rates(settings))
+        self.mode_state = ModeStateMachine(DESKTOP_MODE_NAME, *self.get_settle_times(settings))
+        self.polled_windows = None
+        self.steam_pid_mtime = self.get_steam_pid_mtime()
+        self.audio_backend = AudioBackend()
+        self.window_watcher = WindowWatcher(lambda windows: self.post(self.monitor_window_changes))
+        self.process_detector = ProcessDetector(lambda active: self.post(self.monitor_window_changes))
+        self.transition_runner = TransitionRunner(lambda transition: self.post(self.on_transition_finished, transition))
+        self.session_monitor = SessionMonitor(lambda event, started: self.post(self.on_session_event, event, started))
+        self.topology = TopologyCache(lambda: self.post(self.on_topology_changed))
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def notify(self):
+        state = (self.current_mode(), self.detection_active)
+        if state == self.notified_state:
+            return
+        self.notified_state = state
+        for listener in self.listeners:
+            listener()
+
+    def post(self, function, *args):
+        self.events.put((function, args))
+
+    def start(self):
+        recorder.record_settings(self.settings)
+        if not self.settings.disableAudio:
+            self.audio_backend.start()
+        self.topology.start()
+        self.get_switch_plan()
+        # Handled before any detection event, the first switch may not be needed.
+        self.post(self.reconcile)
+        self.start_detection()
+        self.session_monitor.start()
+
+        self.thread = threading.Thread(target=self.run, name='controller', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if self.thread:
+            self.post(None)
+            self.thread.join(timeout)
+            self.thread = None
+        self.stop_detection()
+        self.session_monitor.stop()
+        self.topology.stop()
+        self.transition_runner.shutdown(None if deadline is None else max(0, deadline - time.monotonic()))
+
+    def shutdown(self, timeout=SHUTDOWN_TIMEOUT):
+        """Stops and switches back to desktop mode, giving up after timeout seconds.
+
+        Whatever is left undone is in the layout journal for --restore.
+        """
+        deadline = time.monotonic() + timeout
+        self.stop(timeout / 2)
+        if self.switch_plan and not self.switch_plan.desktopmode.is_active():
+            logger.info("Cleaning up and switching to desktop mode before exit.")
+            # A hung screen tool or audio server must not block logout.
+            restore = threading.Thread(target=self.restore_desktop, name='restore', daemon=True)
+            restore.start()
+            restore.join(max(0, deadline - time.monotonic()))
+            if restore.is_alive():
+                logger.warning("Desktop mode not restored within %ss, run bigpicturetv.py --restore", timeout)
+        self.audio_backend.stop()
+
+    def restore_desktop(self):
+        self.switch_plan.desktopmode.activate(self.switch_plan.active_mode())
+        journal.clear_layout()
+
+    def save_layout(self):
+        active_mode = self.switch_plan.active_mode()
+        desktopmode = self.switch_plan.desktopmode
+        if active_mode is None or active_mode is desktopmode:
+            journal.clear_layout()
+            return
+        screen_name = desktopmode.resolve_output(desktopmode.screen_name) or desktopmode.screen_name
+        off_screen = desktopmode.get_off_screen(active_mode)
+        command = self.switch_plan.display_backend.command(screen_name, desktopmode.resolve_output(off_screen) or off_screen)
+        audio = None if desktopmode.disable_audio else self.audio_backend.find_sink(desktopmode.audio)
+        try:
+            journal.save_layout(active_mode.mode_name, command, audio)
+        except OSError as e:
+            logger.error("Cannot write the layout journal: %s", e)
+
+    def get_check_rates(self, settings):
+        return settings.checkRate / 1000, settings.idleCheckRate / 1000
+
+    def get_settle_times(self, settings):
+        return settings.gamemodeSettleTime / 1000, settings.desktopSettleTime / 1000
+
+    def next_timeout(self):
+        timeout = self.scheduler.timeout()
+        if not self.detection_active:
+            # A pending change is looked at again on resume, not while paused.
+            return timeout
+        settle_timeout = self.mode_state.timeout(time.monotonic())
+        if timeout is None or settle_timeout is None:
+            return timeout
+        return min(timeout, settle_timeout)
+
+    def run(self):
+        while True:
+            try:
+                function, args = self.events.get(timeout=self.next_timeout())
+            except queue.Empty:
+                if self.detection_active and self.mode_state.timeout(time.monotonic()) == 0:
+                    # A detection change has settled, check it once more before switching.
+                    function, args = self.monitor_window_changes, ()
+                else:
+                    function, args = self.poll_tick, ()
+                    self.scheduler.schedule()
+            if function is None:
+                return
+            try:
+                function(*args)
+            except Exception:
+                logger.exception("Error while handling %s", function.__name__)
+                metrics.increment('failures_total', kind='event')
+
+    def poll_tick(self):
+        start = time.monotonic()
+        self.poll_window_changes()
+        metrics.increment('ticks_total')
+        metrics.observe('tick_duration_seconds', time.monotonic() - start)
+
+    def set_detection_active(self, active):
+        self.post(self.apply_detection_active, active)
+
+    def apply_detection_active(self, active):
+        self.detection_active = active
+        if active:
+            # Detection takes over again from a mode requested through the control socket.
+            self.requested_mode = None
+            self.monitor_window_changes()
+        self.notify()
+
+    def enter_mode(self, mode_name):
+        self.post(self.apply_mode_request, mode_name)
+
+    def apply_mode_request(self, mode_name):
+        # No settle time for a mode pushed from outside, and detection stays
+        # paused so it does not switch back until resumed.
+        mode = self.get_switch_plan().find_mode(mode_name)
+        if mode is None:
+            logger.warning("Unknown mode requested: %s", mode_name)
+            return
+        logger.info("%s requested", mode_name)
+        self.detection_active = False
+        self.requested_mode = mode_name
+        now = time.monotonic()
+        self.mode_state.hold(mode_name, now)
+        running = self.transition_runner.current if self.transition_runner.is_running() else None
+        if running and running.mode is not mode:
+            running.cancel()
+            running = None
+        if running is None and not mode.is_active():
+            # Deferred when its screen is missing, on_topology_changed requests it again.
+            self.request_mode(mode, now)
+        self.notify()
+
+    def has_mode(self, mode_name):
+        switch_plan = self.switch_plan
+        return switch_plan is not None and switch_plan.find_mode(mode_name) is not None
+
+    def status(self):
+        transition = self.transition_runner.current
+        return {
+            'mode': self.current_mode() or 'unknown',
+            'detection': 'active' if self.detection_active else 'paused',
+            'requested': self.requested_mode or 'none',
+            'switching': transition.mode.mode_name if transition and transition.is_running() else 'no',
+            'profiles': ', '.join(mode.mode_name for mode in self.switch_plan.modes) if self.switch_plan else '',
+        }
+
+    def update_settings(self, settings):
+        self.post(self.apply_settings, settings)
+
+    def start_detection(self):
+        if self.settings.detectionStrategy == "process":
+            self.process_detector.start()
+        else:
+            self.window_watcher.start()
+
+    def stop_detection(self):
+        self.window_watcher.stop()
+        self.process_detector.stop()
+
+    def apply_settings(self, settings):
+        restart_detection = settings.detectionStrategy != self.settings.detectionStrategy
+        self.settings = settings
+        recorder.record_settings(settings)
+        if restart_detection:
+            self.stop_detection()
+            self.start_detection()
+        self.switch_plan_stale = True
+        self.scheduler.update(*self.get_check_rates(settings))
+        self.mode_state.update(*self.get_settle_times(settings))
+        if not settings.disableAudio:
+            self.audio_backend.start()
+
+    def on_session_event(self, event, started):
+        if started:
+            self.scheduler.pause(event)
+        else:
+            self.scheduler.resume(event)
+            if event == 'suspend':
+                # Screens may have been reset or unplugged while asleep.
+                self.reconcile()
+
+    def reconcile(self):
+        """Takes the mode the screens and audio are already in.
+
+        Only a mode that differs from the actual state is switched to, and
+        without a known layout the first switch is applied in full.
+        """
+        if self.transition_runner.is_running():
+            return
+        switch_plan = self.get_switch_plan()
+        active_outputs = switch_plan.display_backend.active_outputs()
+        if active_outputs is None:
+            logger.info("Current screen layout unknown, switching without checking it")
+            return
+        default_sink = None if self.settings.disableAudio else self.audio_backend.get_default_sink()
+        detected_mode = self.detect_mode()
+        # The detected mode goes first, several modes can share the same screens.
+        candidates = [detected_mode] + [mode for mode in switch_plan.modes if mode is not detected_mode]
+        current_mode = next((mode for mode in candidates if mode.matches(active_outputs, default_sink)), None)
+        for mode in switch_plan.modes:
+            mode.current_mode = mode is current_mode
+            metrics.set('mode_active', int(mode.is_active()), mode=mode.mode_name)
+        logger.info("Current state: screens %s, audio %s, %s", ', '.join(sorted(active_outputs)) or 'none', default_sink or ('not switched' if self.settings.disableAudio else 'unknown'), current_mode.mode_name if current_mode else 'no matching mode')
+        self.mode_state.switch_finished(self.current_mode())
+        self.save_layout()
+
+        if self.requested_mode and self.requested_mode != self.current_mode():
+            self.request_mode(switch_plan.find_mode(self.requested_mode), time.monotonic())
+        self.monitor_window_changes()
+
+    def on_topology_changed(self):
+        self.scheduler.trigger("outputs changed")
+        self.mode_state.resume()
+        self.prepare_outputs()
+        if self.requested_mode and self.mode_state.switching is None:
+            mode = self.switch_plan.find_mode(self.requested_mode)
+            if mode and not mode.is_active():
+                self.request_mode(mode, time.monotonic())
+        self.monitor_window_changes()
+
+    def prepare_outputs(self):
+        # Mode lookups happen here, off the switch path, whenever outputs change.
+        prepared = set()
+        for mode in self.get_switch_plan().modes:
+            if mode.screen_name and mode.screen_name not in prepared:
+                prepared.add(mode.screen_name)
+                mode.prepare()
+
+    def current_mode(self):
+        switch_plan = self.switch_plan
+        active_mode = switch_plan.active_mode() if switch_plan else None
+        return active_mode.mode_name if active_mode else None
+
+    def detect_mode(self):
+        if self.settings.detectionStrategy == "process":
+            # Only the Big Picture profile can be told from the Steam process.
+            recorder.record_process(self.process_detector.active)
+            return self.switch_plan.gamemode if self.process_detector.active else self.switch_plan.desktopmode
+        return self.check_window_names()
+
+    def check_window_names(self):
+        if self.window_watcher.is_running() and self.window_watcher.windows is not None:
+            windows = self.window_watcher.windows
+        else:
+            windows = list_windows()
+            if windows != self.polled_windows:
+                self.polled_windows = windows
+                self.scheduler.trigger("window list changed")
+        recorder.record_windows(windows)
+
+        index = self.window_matcher.match(windows)
+        return self.switch_plan.desktopmode if index is None else self.switch_plan.game_modes[index]
+
+    def get_steam_pid_mtime(self):
+        try:
+            return os.stat(STEAM_PID_FILE).st_mtime
+        except OSError:
+            return None
+
+    def poll_window_changes(self):
+        steam_pid_mtime = self.get_steam_pid_mtime()
+        if steam_pid_mtime != self.steam_pid_mtime:
+            self.steam_pid_mtime = steam_pid_mtime
+            self.scheduler.trigger("Steam started")
+
+        if self.settings.detectionStrategy == "process":
+            # Only a few small file reads, changes are reported through the callback.
+            self.process_detector.refresh()
+        elif self.window_watcher.is_running():
+            # Events drive detection, the timer only catches anything xprop missed.
+            self.window_watcher.refresh()
+        else:
+            self.monitor_window_changes()
+
+    def monitor_window_changes(self):
+        if not self.detection_active:
+            return
+        with metrics.span('monitor_window_changes'):
+            self.get_switch_plan()
+            mode = self.detect_mode()
+            action = self.mode_state.observe(mode.mode_name, self.current_mode(), time.monotonic())
+            if action == SWITCH:
+                self.request_mode(mode, self.mode_state.changed_at)
+            elif action == CANCEL:
+                self.transition_runner.current.cancel()
+            elif self.mode_state.switching is None:
+                self.deferred_mode = None
+        self.notify()
+
+    def request_mode(self, mode, detected_at):
+        if not mode.is_available():
+            # Nothing to switch to yet, the next hotplug event runs detection again.
+            if self.deferred_mode is not mode:
+                logger.warning("%s deferred, %s is not connected", mode.mode_name, mode.screen_name)
+                self.deferred_mode = mode
+            self.mode_state.defer(mode.mode_name)
+            return
+        self.deferred_mode = None
+        previous_mode = self.switch_plan.active_mode()
+        if previous_mode:
+            previous_mode.deactivate()
+        self.mode_state.switch_started(mode.mode_name)
+        self.transition_runner.start(mode, previous_mode, detected_at)
+
+    def on_transition_finished(self, transition):
+        recorder.record_transition(transition)
+        if transition is not self.transition_runner.current:
+            # Cancelled for a requested mode, whose own transition is running.
+            return
+        completed = not transition.cancelled.is_set()
+        if completed and transition.mode in self.switch_plan.modes:
+            transition.mode.current_mode = True
+            self.scheduler.trigger("mode changed")
+            metrics.observe('detection_latency_seconds', transition.timings['start'])
+            for step in ('screen', 'audio', 'total'):
+                if step in transition.timings:
+                    metrics.observe('switch_step_seconds', transition.timings[step], step=step)
+            self.save_layout()
+        for mode in self.switch_plan.modes:
+            metrics.set('mode_active', int(mode.is_active()), mode=mode.mode_name)
+        self.mode_state.switch_finished(self.current_mode())
+        # Changes seen during the switch were only merged into the target, act on it now.
+        self.monitor_window_changes()
+        self.notify()
+
+    def get_switch_plan(self):
+        if self.switch_plan_stale:
+            switch_plan = build_switch_plan(self.settings, self.audio_backend, self.topology, self.switch_plan)
+            if self.switch_plan and self.switch_plan.display_backend is not switch_plan.display_backend:
+                self.switch_plan.display_backend.close()
+            active_mode = self.switch_plan.active_mode() if self.switch_plan else None
+            if active_mode and switch_plan.find_mode(active_mode.mode_name):
+                switch_plan.find_mode(active_mode.mode_name).current_mode = True
+            self.switch_plan = switch_plan
+            self.window_matcher = compile_matcher([mode.keywords for mode in switch_plan.game_modes])
+            self.switch_plan_stale = False
+            self.prepare_outputs()
+        return self.switch_plan
@@ -0,0 +1,59 @@
+import os
+import sys
+import signal
+import subprocess
+import threading
+import logging
+from controller import Controller
+from modes import UnsupportedSessionError
+from settings import load_settings, save_settings, settings_exist
+import control
+
+logger = logging.getLogger(__name__)
+
+LAUNCHER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bigpicturetv.py")
+
+
+class Daemon:
+    """Detection and switching without any Qt widget, settings UI on demand."""
+
+    def __init__(self):
+        if not settings_exist():
+            save_settings(load_settings())
+        self.controller = Controller(load_settings())
+        self.stopping = threading.Event()
+        self.server = control.ControlServer(control.CommandHandler(self.controller, self.show_settings, self.stopping.set))
+
+    def show_settings(self):
+        subprocess.Popen([sys.executable, LAUNCHER, '--settings'], cwd=os.path.dirname(LAUNCHER))
+
+    def run(self):
+        try:
+            self.server.acquire()
+        except control.AlreadyRunningError:
+            logger.error("BigPictureTV is already running.")
+            return 1
+        except OSError as e:
+            logger.error("Cannot create the control socket: %s", e)
+            return 1
+        try:
+            self.controller.start()
+        except UnsupportedSessionError as e:
+            logger.error(str(e))
+            self.server.stop()
+            return 1
+        self.server.start()
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: self.stopping.set())
+        logger.info("BigPictureTV daemon running, control socket: %s", self.server.path)
+        while not self.stopping.wait(3600):
+            pass
+
+        self.server.stop()
+        self.controller.shutdown()
+        return 0
+
+
+def main():
+    return Daemon().run()
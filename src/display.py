@@ -0,0 +1,699 @@
+import re
+import json
+import ctypes
+import ctypes.util
+import threading
+import logging
+from topology import Output, edid_identity
+from metrics import metrics
+from commands import runner, CommandError
+
+logger = logging.getLogger(__name__)
+
+MUTTER_BUS_NAME = 'org.gnome.Mutter.DisplayConfig'
+MUTTER_OBJECT_PATH = '/org/gnome/Mutter/DisplayConfig'
+MUTTER_APPLY_TEMPORARY = 1
+KSCREEN_BUS_NAME = 'org.kde.KScreen'
+KSCREEN_OBJECT_PATH = '/backend'
+KSCREEN_INTERFACE = 'org.kde.kscreen.Backend'
+XRANDR_OUTPUT_PATTERN = re.compile(r'^(\S+) (connected|disconnected)')
+XRANDR_ACTIVE_PATTERN = re.compile(r'^(\S+) connected (?:primary )?\d+x\d+\+\d+\+\d+')
+XRANDR_MODE_PATTERN = re.compile(r'^\s+(\d+x\d+\S*)\s+(.*)$')
+XRANDR_RATE_PATTERN = re.compile(r'([\d.]+)([ *]?)([ +]?)')
+
+
+class DisplayBackendError(Exception):
+    pass
+
+
+class DisplayBackend:
+    name = None
+
+    def apply(self, output_screen, off_screen):
+        raise NotImplementedError
+
+    def prepare(self, output_screen):
+        """Resolves the layout of a connected output ahead of the switch."""
+
+    def active_outputs(self):
+        """Names of the outputs currently showing something, None if unknown."""
+        return None
+
+    def close(self):
+        """Releases the display server connection, if the backend holds one."""
+
+
+class CommandDisplayBackend(DisplayBackend):
+    name = 'command'
+
+    def __init__(self, randr_path, session_type):
+        self.randr_path = randr_path
+        self.session_type = session_type
+        self.commands = {}
+        self.staged = {}
+
+    def prepare(self, output_screen):
+        try:
+            if self.session_type == "x11":
+                staged = parse_xrandr_mode(runner.run([self.randr_path, '--query']), output_screen)
+            elif self.session_type == "kde-wayland":
+                staged = parse_kscreen_mode(runner.run([self.randr_path, '-j']), output_screen)
+            else:
+                # gnome-randr is only a fallback, Mutter is driven in-process.
+                return
+        except (CommandError, ValueError) as e:
+            raise DisplayBackendError(f"Cannot read the modes of {output_screen}: {e}")
+        if staged != self.staged.get(output_screen):
+            self.staged[output_screen] = staged
+            self.commands = {}
+            logger.info("Staged layout for %s: %s", output_screen, staged)
+
+    def active_outputs(self):
+        try:
+            if self.session_type == "x11":
+                query = runner.run([self.randr_path, '--query'])
+                return {match.group(1) for match in map(XRANDR_ACTIVE_PATTERN.match, query.splitlines()) if match}
+            elif self.session_type == "kde-wayland":
+                config = json.loads(runner.run([self.randr_path, '-j']))
+                return {output.get('name') for output in config.get('outputs', []) if output.get('enabled')}
+        except (CommandError, ValueError) as e:
+            raise DisplayBackendError(f"Cannot read the current layout: {e}")
+        return None
+
+    def list_outputs(self):
+        try:
+            if self.session_type == "x11":
+                query = runner.run([self.randr_path, '--query'])
+                matches = [match for match in map(XRANDR_OUTPUT_PATTERN.match, query.splitlines()) if match]
+                return {match.group(1): Output(match.group(1), match.group(2) == 'connected') for match in matches}
+            elif self.session_type == "kde-wayland":
+                config = json.loads(runner.run([self.randr_path, '-j']))
+                return {str(output.get('name')): Output(str(output.get('name')), bool(output.get('connected', True))) for output in config.get('outputs', [])}
+        except (CommandError, ValueError) as e:
+            raise DisplayBackendError(f"Cannot list the outputs: {e}")
+        return None
+
+    def command(self, output_screen, off_screen):
+        key = (output_screen, off_screen)
+        if key not in self.commands:
+            self.commands[key] = generate_screen_command(self.randr_path, output_screen, off_screen, self.session_type, self.staged.get(output_screen))
+        return self.commands[key]
+
+    def apply(self, output_screen, off_screen):
+        command = self.command(output_screen, off_screen)
+        logger.info("Running: %s", command)
+        try:
+            runner.run(command)
+        except CommandError as e:
+            raise DisplayBackendError(str(e))
+
+
+class MutterDisplayBackend(DisplayBackend):
+    name = 'mutter'
+
+    def __init__(self):
+        import dbus
+        self.dbus = dbus
+        bus = dbus.SessionBus()
+        if not bus.name_has_owner(MUTTER_BUS_NAME):
+            raise DisplayBackendError(f"{MUTTER_BUS_NAME} is not available")
+        self.display_config = dbus.Interface(bus.get_object(MUTTER_BUS_NAME, MUTTER_OBJECT_PATH), MUTTER_BUS_NAME)
+        self.staged = {}
+
+    def prepare(self, output_screen):
+        try:
+            _, monitors, _, _ = self.display_config.GetCurrentState()
+        except self.dbus.DBusException as e:
+            raise DisplayBackendError(str(e))
+        for (connector, _, _, _), modes, _ in monitors:
+            if connector == output_screen and modes:
+                mode = pick_mutter_mode(modes)
+                self.staged[output_screen] = (str(mode[0]), float(mode[4]))
+
+    def apply(self, output_screen, off_screen):
+        try:
+            serial, monitors, logical_monitors, _ = self.display_config.GetCurrentState()
+        except self.dbus.DBusException as e:
+            raise DisplayBackendError(str(e))
+
+        target = None
+        for (connector, _, _, _), modes, _ in monitors:
+            if connector == output_screen:
+                target = modes
+        if not target:
+            raise DisplayBackendError(f"{output_screen} is not connected")
+
+        mode_ids = [str(mode[0]) for mode in target]
+        staged = self.staged.get(output_screen)
+        if staged and staged[0] in mode_ids:
+            mode_id, scale = staged
+        else:
+            mode = pick_mutter_mode(target)
+            mode_id, scale = mode[0], mode[4]
+        position = None
+        layout = []
+        for x, y, monitor_scale, transform, _, members, _ in logical_monitors:
+            connectors = [str(member[0]) for member in members]
+            if off_screen in connectors:
+                # The new output takes the place of the one it replaces.
+                position = (x, y)
+                continue
+            if output_screen in connectors:
+                position = position or (x, y)
+                continue
+            layout.append((x, y, monitor_scale, transform, False, [(connector, current_mutter_mode(monitors, connector), {}) for connector in connectors]))
+        x, y = position or (0, 0)
+        layout.insert(0, (x, y, scale, 0, True, [(output_screen, mode_id, {})]))
+
+        try:
+            self.display_config.ApplyMonitorsConfig(serial, MUTTER_APPLY_TEMPORARY, layout, {}, signature='uua(iiduba(ssa{sv}))a{sv}')
+        except self.dbus.DBusException as e:
+            raise DisplayBackendError(str(e))
+
+    def active_outputs(self):
+        try:
+            _, _, logical_monitors, _ = self.display_config.GetCurrentState()
+        except self.dbus.DBusException as e:
+            raise DisplayBackendError(str(e))
+        return {str(member[0]) for logical_monitor in logical_monitors for member in logical_monitor[5]}
+
+    def list_outputs(self):
+        try:
+            _, monitors, _, _ = self.display_config.GetCurrentState()
+        except self.dbus.DBusException as e:
+            raise DisplayBackendError(str(e))
+        # Mutter only lists connected monitors.
+        outputs = {}
+        for (connector, vendor, product, serial), _, _ in monitors:
+            outputs[str(connector)] = Output(str(connector), True, f"{vendor}-{product}-{serial}")
+        return outputs
+
+
+class KScreenDisplayBackend(DisplayBackend):
+    name = 'kscreen'
+
+    def __init__(self):
+        import dbus
+        self.dbus = dbus
+        bus = dbus.SessionBus()
+        try:
+            self.backend = dbus.Interface(bus.get_object(KSCREEN_BUS_NAME, KSCREEN_OBJECT_PATH), KSCREEN_INTERFACE)
+        except dbus.DBusException as e:
+            raise DisplayBackendError(str(e))
+        self.staged = {}
+
+    def prepare(self, output_screen):
+        try:
+            config = self.backend.getConfig()
+        except self.dbus.DBusException as e:
+            raise DisplayBackendError(str(e))
+        for output in config.get('outputs', []):
+            if output.get('name') == output_screen and output.get('modes'):
+                self.staged[output_screen] = pick_kscreen_mode(output)
+
+    def apply(self, output_screen, off_screen):
+        try:
+            config = self.backend.getConfig()
+        except self.dbus.DBusException as e:
+            raise DisplayBackendError(str(e))
+
+        found = False
+        for output in config.get('outputs', []):
+            if output.get('name') == output_screen:
+                if not output.get('connected', True):
+                    raise DisplayBackendError(f"{output_screen} is not connected")
+                output['enabled'] = self.dbus.Boolean(True, variant_level=1)
+                staged = self.staged.get(output_screen)
+                if staged and staged['mode'] in [str(mode.get('id')) for mode in output.get('modes', [])]:
+                    # The same layout kscreen-doctor is given in the fallback.
+                    output['currentModeId'] = self.dbus.String(staged['mode'], variant_level=1)
+                    output['scale'] = self.dbus.Double(float(staged['scale']), variant_level=1)
+                    output['pos'] = self.dbus.Dictionary({'x': self.dbus.Int32(0), 'y': self.dbus.Int32(0)}, signature='sv', variant_level=1)
+                found = True
+            elif output.get('name') == off_screen:
+                output['enabled'] = self.dbus.Boolean(False, variant_level=1)
+        if not found:
+            raise DisplayBackendError(f"{output_screen} is not known to KScreen")
+
+        try:
+            self.backend.setConfig(config)
+        except self.dbus.DBusException as e:
+            raise DisplayBackendError(str(e))
+
+    def active_outputs(self):
+        try:
+            config = self.backend.getConfig()
+        except self.dbus.DBusException as e:
+            raise DisplayBackendError(str(e))
+        return {str(output.get('name')) for output in config.get('outputs', []) if output.get('enabled')}
+
+
+class XRRScreenResources(ctypes.Structure):
+    _fields_ = [
+        ('timestamp', ctypes.c_ulong),
+        ('configTimestamp', ctypes.c_ulong),
+        ('ncrtc', ctypes.c_int),
+        ('crtcs', ctypes.POINTER(ctypes.c_ulong)),
+        ('noutput', ctypes.c_int),
+        ('outputs', ctypes.POINTER(ctypes.c_ulong)),
+        ('nmode', ctypes.c_int),
+        ('modes', ctypes.c_void_p),
+    ]
+
+
+class XRRModeInfo(ctypes.Structure):
+    _fields_ = [
+        ('id', ctypes.c_ulong),
+        ('width', ctypes.c_uint),
+        ('height', ctypes.c_uint),
+        ('dotClock', ctypes.c_ulong),
+        ('hSyncStart', ctypes.c_uint),
+        ('hSyncEnd', ctypes.c_uint),
+        ('hTotal', ctypes.c_uint),
+        ('hSkew', ctypes.c_uint),
+        ('vSyncStart', ctypes.c_uint),
+        ('vSyncEnd', ctypes.c_uint),
+        ('vTotal', ctypes.c_uint),
+        ('name', ctypes.c_char_p),
+        ('nameLength', ctypes.c_uint),
+        ('modeFlags', ctypes.c_ulong),
+    ]
+
+
+class XRROutputInfo(ctypes.Structure):
+    _fields_ = [
+        ('timestamp', ctypes.c_ulong),
+        ('crtc', ctypes.c_ulong),
+        ('name', ctypes.c_char_p),
+        ('nameLen', ctypes.c_int),
+        ('mm_width', ctypes.c_ulong),
+        ('mm_height', ctypes.c_ulong),
+        ('connection', ctypes.c_ushort),
+        ('subpixel_order', ctypes.c_ushort),
+        ('ncrtc', ctypes.c_int),
+        ('crtcs', ctypes.POINTER(ctypes.c_ulong)),
+        ('nclone', ctypes.c_int),
+        ('clones', ctypes.POINTER(ctypes.c_ulong)),
+        ('nmode', ctypes.c_int),
+        ('npreferred', ctypes.c_int),
+        ('modes', ctypes.POINTER(ctypes.c_ulong)),
+    ]
+
+
+class XRRCrtcInfo(ctypes.Structure):
+    _fields_ = [
+        ('timestamp', ctypes.c_ulong),
+        ('x', ctypes.c_int),
+        ('y', ctypes.c_int),
+        ('width', ctypes.c_uint),
+        ('height', ctypes.c_uint),
+        ('mode', ctypes.c_ulong),
+        ('rotation', ctypes.c_ushort),
+        ('noutput', ctypes.c_int),
+        ('outputs', ctypes.POINTER(ctypes.c_ulong)),
+        ('rotations', ctypes.c_ushort),
+        ('npossible', ctypes.c_int),
+        ('possible', ctypes.POINTER(ctypes.c_ulong)),
+    ]
+
+
+X_ERROR_HANDLER = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+RR_CONNECTED = 0
+ANY_PROPERTY_TYPE = 0
+EDID_LENGTH = 128
+RR_ROTATE_0 = 1
+CURRENT_TIME = 0
+MM_PER_INCH = 25.4
+DEFAULT_DPI = 96
+
+
+class XRandrDisplayBackend(DisplayBackend):
+    """Applies the layout with libXrandr calls on our own X connection."""
+
+    name = 'xrandr'
+
+    def __init__(self):
+        xlib_path = ctypes.util.find_library('X11')
+        xrandr_path = ctypes.util.find_library('Xrandr')
+        if not xlib_path or not xrandr_path:
+            raise DisplayBackendError("libX11 or libXrandr not found")
+        self.xlib = ctypes.CDLL(xlib_path)
+        self.xrandr = ctypes.CDLL(xrandr_path)
+        self.declare_functions()
+        self.lock = threading.Lock()
+        self.x_errors = 0
+        # Keep a reference, Xlib calls back into it for every protocol error.
+        self.error_handler = X_ERROR_HANDLER(self.on_x_error)
+
+        self.staged = {}
+
+        self.display = self.xlib.XOpenDisplay(None)
+        if not self.display:
+            raise DisplayBackendError("Cannot open X display")
+        self.xlib.XSetErrorHandler(self.error_handler)
+        self.root = self.xlib.XDefaultRootWindow(self.display)
+
+    def declare_functions(self):
+        self.xlib.XOpenDisplay.restype = ctypes.c_void_p
+        self.xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        self.xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        self.xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+        self.xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        self.xlib.XSetErrorHandler.argtypes = [X_ERROR_HANDLER]
+        self.xlib.XGrabServer.argtypes = [ctypes.c_void_p]
+        self.xlib.XUngrabServer.argtypes = [ctypes.c_void_p]
+        self.xlib.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        self.xrandr.XRRGetScreenResourcesCurrent.restype = ctypes.POINTER(XRRScreenResources)
+        self.xrandr.XRRGetScreenResourcesCurrent.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+        self.xrandr.XRRFreeScreenResources.argtypes = [ctypes.POINTER(XRRScreenResources)]
+        self.xrandr.XRRGetOutputInfo.restype = ctypes.POINTER(XRROutputInfo)
+        self.xrandr.XRRGetOutputInfo.argtypes = [ctypes.c_void_p, ctypes.POINTER(XRRScreenResources), ctypes.c_ulong]
+        self.xrandr.XRRFreeOutputInfo.argtypes = [ctypes.POINTER(XRROutputInfo)]
+        self.xrandr.XRRGetCrtcInfo.restype = ctypes.POINTER(XRRCrtcInfo)
+        self.xrandr.XRRGetCrtcInfo.argtypes = [ctypes.c_void_p, ctypes.POINTER(XRRScreenResources), ctypes.c_ulong]
+        self.xrandr.XRRFreeCrtcInfo.argtypes = [ctypes.POINTER(XRRCrtcInfo)]
+        self.xrandr.XRRSetCrtcConfig.argtypes = [
+            ctypes.c_void_p, ctypes.POINTER(XRRScreenResources), ctypes.c_ulong, ctypes.c_ulong,
+            ctypes.c_int, ctypes.c_int, ctypes.c_ulong, ctypes.c_ushort, ctypes.POINTER(ctypes.c_ulong), ctypes.c_int
+        ]
+        self.xrandr.XRRSetScreenSize.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]
+        self.xlib.XInternAtom.restype = ctypes.c_ulong
+        self.xlib.XInternAtom.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+        self.xlib.XFree.argtypes = [ctypes.c_void_p]
+        self.xrandr.XRRGetOutputProperty.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_long, ctypes.c_long, ctypes.c_int, ctypes.c_int, ctypes.c_ulong,
+            ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_ulong),
+            ctypes.POINTER(ctypes.POINTER(ctypes.c_ubyte))
+        ]
+
+    def close(self):
+        with self.lock:
+            if self.display:
+                self.xlib.XCloseDisplay(self.display)
+                self.display = None
+
+    def check_display(self):
+        if not self.display:
+            raise DisplayBackendError("X display is closed")
+
+    def on_x_error(self, display, event):
+        self.x_errors += 1
+        return 0
+
+    def get_outputs(self, resources):
+        outputs = {}
+        for i in range(resources.contents.noutput):
+            output_id = resources.contents.outputs[i]
+            info = self.xrandr.XRRGetOutputInfo(self.display, resources, output_id)
+            outputs[info.contents.name.decode()] = (output_id, info)
+        return outputs
+
+    def get_mode(self, resources, mode_id):
+        modes = ctypes.cast(resources.contents.modes, ctypes.POINTER(XRRModeInfo))
+        for i in range(resources.contents.nmode):
+            if modes[i].id == mode_id:
+                return modes[i]
+        return None
+
+    def apply(self, output_screen, off_screen):
+        with self.lock:
+            self.check_display()
+            self.x_errors = 0
+            self.xlib.XGrabServer(self.display)
+            resources = self.xrandr.XRRGetScreenResourcesCurrent(self.display, self.root)
+            outputs = self.get_outputs(resources)
+            try:
+                self.apply_layout(resources, outputs, output_screen, off_screen)
+            finally:
+                for _, info in outputs.values():
+                    self.xrandr.XRRFreeOutputInfo(info)
+                self.xrandr.XRRFreeScreenResources(resources)
+                self.xlib.XUngrabServer(self.display)
+                self.xlib.XSync(self.display, 0)
+            if self.x_errors:
+                raise DisplayBackendError(f"X server rejected the layout ({self.x_errors} errors)")
+
+    def prepare(self, output_screen):
+        with self.lock:
+            self.check_display()
+            resources = self.xrandr.XRRGetScreenResourcesCurrent(self.display, self.root)
+            outputs = self.get_outputs(resources)
+            try:
+                if output_screen in outputs:
+                    info = outputs[output_screen][1].contents
+                    if info.connection == RR_CONNECTED and info.nmode:
+                        # Preferred modes come first, the same choice as --auto.
+                        self.staged[output_screen] = info.modes[0]
+            finally:
+                for _, info in outputs.values():
+                    self.xrandr.XRRFreeOutputInfo(info)
+                self.xrandr.XRRFreeScreenResources(resources)
+
+    def apply_layout(self, resources, outputs, output_screen, off_screen):
+        if output_screen not in outputs:
+            raise DisplayBackendError(f"Unknown output {output_screen}")
+        output_id, info = outputs[output_screen]
+        if info.contents.connection != RR_CONNECTED or info.contents.nmode == 0:
+            raise DisplayBackendError(f"{output_screen} is not connected")
+
+        crtc = info.contents.crtc
+        mode_id = None
+        if crtc:
+            crtc_info = self.xrandr.XRRGetCrtcInfo(self.display, resources, crtc)
+            mode_id = crtc_info.contents.mode
+            moved = crtc_info.contents.x != 0 or crtc_info.contents.y != 0
+            self.xrandr.XRRFreeCrtcInfo(crtc_info)
+            if moved:
+                # It is moved to the origin, the screen could not shrink around it otherwise.
+                self.disable_crtc(resources, crtc)
+        if not mode_id:
+            mode_id = self.staged.get(output_screen)
+        if not mode_id or self.get_mode(resources, mode_id) is None:
+            # Same choice as --auto: the first preferred mode, or the first mode.
+            mode_id = info.contents.modes[0]
+        if not crtc:
+            crtc = self.find_free_crtc(resources, info)
+
+        mode = self.get_mode(resources, mode_id)
+        if mode is None or not crtc:
+            raise DisplayBackendError(f"No usable mode or CRTC for {output_screen}")
+
+        if off_screen in outputs and outputs[off_screen][1].contents.crtc:
+            self.disable_crtc(resources, outputs[off_screen][1].contents.crtc)
+
+        self.xrandr.XRRSetScreenSize(
+            self.display, self.root, mode.width, mode.height,
+            int(mode.width * MM_PER_INCH / DEFAULT_DPI), int(mode.height * MM_PER_INCH / DEFAULT_DPI)
+        )
+        output_ids = (ctypes.c_ulong * 1)(output_id)
+        self.xrandr.XRRSetCrtcConfig(self.display, resources, crtc, CURRENT_TIME, 0, 0, mode_id, RR_ROTATE_0, output_ids, 1)
+
+    def list_outputs(self):
+        with self.lock:
+            self.check_display()
+            edid_atom = self.xlib.XInternAtom(self.display, b'EDID', 1)
+            resources = self.xrandr.XRRGetScreenResourcesCurrent(self.display, self.root)
+            outputs = self.get_outputs(resources)
+            try:
+                return {
+                    name: Output(name, info.contents.connection == RR_CONNECTED, self.get_edid_identity(output_id, edid_atom))
+                    for name, (output_id, info) in outputs.items()
+                }
+            finally:
+                for _, info in outputs.values():
+                    self.xrandr.XRRFreeOutputInfo(info)
+                self.xrandr.XRRFreeScreenResources(resources)
+
+    def active_outputs(self):
+        with self.lock:
+            self.check_display()
+            resources = self.xrandr.XRRGetScreenResourcesCurrent(self.display, self.root)
+            outputs = self.get_outputs(resources)
+            try:
+                return {name for name, (_, info) in outputs.items() if info.contents.crtc}
+            finally:
+                for _, info in outputs.values():
+                    self.xrandr.XRRFreeOutputInfo(info)
+                self.xrandr.XRRFreeScreenResources(resources)
+
+    def get_edid_identity(self, output_id, edid_atom):
+        if not edid_atom:
+            return None
+        actual_type = ctypes.c_ulong()
+        actual_format = ctypes.c_int()
+        nitems = ctypes.c_ulong()
+        bytes_after = ctypes.c_ulong()
+        data = ctypes.POINTER(ctypes.c_ubyte)()
+        self.xrandr.XRRGetOutputProperty(
+            self.display, output_id, edid_atom, 0, EDID_LENGTH // 4, 0, 0, ANY_PROPERTY_TYPE,
+            ctypes.byref(actual_type), ctypes.byref(actual_format), ctypes.byref(nitems), ctypes.byref(bytes_after), ctypes.byref(data)
+        )
+        if not data:
+            return None
+        try:
+            if actual_format.value != 8:
+                return None
+            return edid_identity(bytes(data[:nitems.value]))
+        finally:
+            self.xlib.XFree(data)
+
+    def find_free_crtc(self, resources, info):
+        for i in range(info.contents.ncrtc):
+            crtc = info.contents.crtcs[i]
+            crtc_info = self.xrandr.XRRGetCrtcInfo(self.display, resources, crtc)
+            free = crtc_info.contents.noutput == 0
+            self.xrandr.XRRFreeCrtcInfo(crtc_info)
+            if free:
+                return crtc
+        return None
+
+    def disable_crtc(self, resources, crtc):
+        self.xrandr.XRRSetCrtcConfig(self.display, resources, crtc, CURRENT_TIME, 0, 0, 0, RR_ROTATE_0, None, 0)
+
+
+class DisplayBackendChain(DisplayBackend):
+    """Tries the in-process backends first and falls back to the command line tool."""
+
+    def __init__(self, backends):
+        self.backends = backends
+        self.name = backends[0].name
+
+    def apply(self, output_screen, off_screen):
+        for backend in self.backends:
+            try:
+                backend.apply(output_screen, off_screen)
+                return backend.name
+            except DisplayBackendError as e:
+                logger.warning("Display backend %s failed: %s", backend.name, e)
+                metrics.increment('failures_total', kind='display_backend')
+        raise DisplayBackendError(f"No display backend could switch to {output_screen}")
+
+    def command(self, output_screen, off_screen):
+        """Command line equivalent of a switch, to apply it from another process."""
+        return self.backends[-1].command(output_screen, off_screen)
+
+    def prepare(self, output_screen):
+        # The fallbacks too, a failed in-process switch must not fall back to a default layout.
+        for backend in self.backends:
+            try:
+                backend.prepare(output_screen)
+            except DisplayBackendError as e:
+                logger.warning("Display backend %s cannot prepare %s: %s", backend.name, output_screen, e)
+
+    def close(self):
+        for backend in self.backends:
+            backend.close()
+
+    def list_outputs(self):
+        for backend in self.backends:
+            if hasattr(backend, 'list_outputs'):
+                try:
+                    return backend.list_outputs()
+                except DisplayBackendError as e:
+                    logger.warning("Display backend %s cannot list outputs: %s", backend.name, e)
+        return None
+
+    def active_outputs(self):
+        for backend in self.backends:
+            try:
+                active_outputs = backend.active_outputs()
+            except DisplayBackendError as e:
+                logger.warning("Display backend %s cannot read the current layout: %s", backend.name, e)
+                continue
+            if active_outputs is not None:
+                return active_outputs
+        return None
+
+
+IN_PROCESS_BACKENDS = {
+    "x11": XRandrDisplayBackend,
+    "gnome-wayland": MutterDisplayBackend,
+    "kde-wayland": KScreenDisplayBackend,
+}
+
+
+def create_display_backend(session_type, randr_path, in_process=True):
+    backends = []
+    backend_class = IN_PROCESS_BACKENDS.get(session_type)
+    if in_process and backend_class:
+        try:
+            backends.append(backend_class())
+        except Exception as e:
+            # Missing libraries, no bus or no X display all mean the same here.
+            logger.info("In-process %s display backend unavailable: %s", session_type, e)
+    backends.append(CommandDisplayBackend(randr_path, session_type))
+    logger.info("Display backend: %s", backends[0].name)
+    return DisplayBackendChain(backends)
+
+
+def pick_mutter_mode(modes):
+    for wanted in ('is-current', 'is-preferred'):
+        for mode in modes:
+            if mode[6].get(wanted):
+                return mode
+    return modes[0]
+
+
+def current_mutter_mode(monitors, connector):
+    for (name, _, _, _), modes, _ in monitors:
+        if name == connector:
+            return pick_mutter_mode(modes)[0]
+    return ''
+
+
+def parse_xrandr_mode(query, output_screen):
+    """Current mode of the output, or its preferred one, from `xrandr --query`."""
+    candidates = {}
+    in_output = False
+    for line in query.splitlines():
+        match = XRANDR_OUTPUT_PATTERN.match(line)
+        if match:
+            in_output = match.group(1) == output_screen
+            continue
+        match = XRANDR_MODE_PATTERN.match(line)
+        if not in_output or not match:
+            continue
+        for rate, current, preferred in XRANDR_RATE_PATTERN.findall(match.group(2)):
+            staged = {"mode": match.group(1), "rate": rate}
+            candidates.setdefault('first', staged)
+            if current == '*':
+                candidates.setdefault('current', staged)
+            if preferred == '+':
+                candidates.setdefault('preferred', staged)
+    for kind in ('current', 'preferred', 'first'):
+        if kind in candidates:
+            return candidates[kind]
+    return None
+
+
+def parse_kscreen_mode(config, output_screen):
+    """Mode and scale of the output from `kscreen-doctor -j`."""
+    for output in json.loads(config).get('outputs', []):
+        if output.get('name') == output_screen and output.get('modes'):
+            return pick_kscreen_mode(output)
+    return None
+
+
+def pick_kscreen_mode(output):
+    """Current mode of an enabled output, its preferred one otherwise."""
+    mode_ids = [str(mode.get('id')) for mode in output['modes']]
+    preferred = [str(mode_id) for mode_id in output.get('preferredModes', []) if str(mode_id) in mode_ids]
+    if output.get('enabled') and str(output.get('currentModeId')) in mode_ids:
+        mode_id = str(output['currentModeId'])
+    else:
+        mode_id = preferred[0] if preferred else mode_ids[0]
+    return {"mode": mode_id, "scale": output.get('scale', 1)}
+
+
+def generate_screen_command(randr_path, output_screen, off_screen, session_type, staged=None):
+    if session_type == "x11" and staged:
+        return [randr_path, '--output', output_screen, '--mode', staged['mode'], '--rate', staged['rate'], '--pos', '0x0', '--output', off_screen, '--off']
+    elif session_type == "x11" or session_type == "gnome-wayland":
+        return [randr_path, '--output', output_screen, '--auto', '--output', off_screen, '--off']
+    elif session_type == "kde-wayland" and staged:
+        return [
+            randr_path, f'output.{output_screen}.enable', f'output.{output_screen}.mode.{staged["mode"]}',
+            f'output.{output_screen}.position.0,0', f'output.{output_screen}.scale.{staged["scale"]}', f'output.{off_screen}.disable'
+        ]
+    elif session_type == "kde-wayland":
+        return [randr_path, f'output.{output_screen}.enable', f'output.{off_screen}.disable']
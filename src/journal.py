@@ -0,0 +1,75 @@
+import os
+import json
+import tempfile
+import logging
+from commands import runner, CommandError
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_PATH = os.path.join(os.path.expanduser("~"), ".cache/BigPictureTV/layout.json")
+
+
+def save_layout(mode_name, restore_command, audio):
+    """Remembers how to get back to the desktop while another mode is active.
+
+    restore_command is the screen tool command line of the desktop layout and
+    audio the desktop sink, so restoring needs neither the settings nor Qt.
+    """
+    directory = os.path.dirname(JOURNAL_PATH)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(prefix='.layout-', suffix='.json', dir=directory)
+    try:
+        with os.fdopen(descriptor, 'w') as f:
+            json.dump({'mode': mode_name, 'screen': restore_command, 'audio': audio}, f)
+        os.replace(temp_path, JOURNAL_PATH)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def clear_layout():
+    try:
+        os.unlink(JOURNAL_PATH)
+    except FileNotFoundError:
+        pass
+
+
+def load_layout():
+    try:
+        with open(JOURNAL_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.error("Cannot read %s: %s", JOURNAL_PATH, e)
+        return None
+
+
+def restore():
+    """Brings the desktop layout back after an exit that left another mode active."""
+    import control
+    if control.is_running():
+        logger.info("BigPictureTV is running, leaving the layout to it.")
+        return 0
+    layout = load_layout()
+    if layout is None:
+        logger.info("Nothing to restore.")
+        return 0
+
+    logger.info("Restoring the desktop layout, %s was left active.", layout['mode'])
+    failed = False
+    try:
+        runner.run(layout['screen'], retries=1)
+    except CommandError as e:
+        logger.error("Cannot restore the screens: %s", e)
+        failed = True
+    if layout.get('audio'):
+        try:
+            runner.run(['pactl', 'set-default-sink', layout['audio']])
+        except CommandError as e:
+            logger.error("Cannot restore the audio output: %s", e)
+            failed = True
+    if failed:
+        return 1
+    clear_layout()
+    return 0
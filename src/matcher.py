@@ -0,0 +1,120 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+ALTERNATIVE_SEPARATOR = '|'
+REGEX_PREFIX = 're:'
+CLASS_PREFIX = 'class:'
+
+
+def window_class_names(wm_class):
+    wm_class = wm_class.lower()
+    return {wm_class, *wm_class.split('.')}
+
+
+class KeywordSet:
+    def __init__(self, tokens):
+        self.keywords = []
+        self.patterns = []
+        self.classes = []
+        for token in tokens:
+            if token.startswith(REGEX_PREFIX):
+                self.patterns.append(re.compile(token[len(REGEX_PREFIX):], re.IGNORECASE))
+            elif token.startswith(CLASS_PREFIX):
+                self.classes.append(token[len(CLASS_PREFIX):].lower())
+            else:
+                self.keywords.append(token.lower())
+
+    def is_empty(self):
+        return not (self.keywords or self.patterns or self.classes)
+
+    def matches(self, wm_class, title):
+        if self.classes:
+            names = window_class_names(wm_class)
+            if not all(window_class in names for window_class in self.classes):
+                return False
+        title_lower = title.lower()
+        if not all(keyword in title_lower for keyword in self.keywords):
+            return False
+        return all(pattern.search(title) for pattern in self.patterns)
+
+
+def split_keyword_sets(tokens):
+    keyword_sets = []
+    current = []
+    for token in list(tokens) + [ALTERNATIVE_SEPARATOR]:
+        if token == ALTERNATIVE_SEPARATOR:
+            keyword_set = KeywordSet(current)
+            if not keyword_set.is_empty():
+                keyword_sets.append(keyword_set)
+            current = []
+        else:
+            current.append(token)
+    return keyword_sets
+
+
+class WindowMatcher:
+    """Triggers of every profile compiled into a single index.
+
+    Each profile gives a token list, in priority order. Sets are separated by
+    `|` and any of them matching is enough. Inside a set every token has to
+    match: plain words are searched in the lowercased title, `re:` tokens are
+    regular expressions on the title and `class:` tokens must equal the
+    WM_CLASS instance or class name. Sets with a class are indexed by it, so
+    a window is only tested against the sets that could match it.
+
+    One pass over the window list gives the highest priority profile found.
+    Results are cached per window id and title so only new or renamed
+    windows are evaluated again.
+    """
+
+    def __init__(self, triggers):
+        self.by_class = {}
+        self.any_class = []
+        for priority, tokens in enumerate(triggers):
+            try:
+                keyword_sets = split_keyword_sets(tokens)
+            except re.error as e:
+                logger.error(f"Invalid detection pattern: {e}")
+                continue
+            for keyword_set in keyword_sets:
+                entry = (priority, keyword_set)
+                if keyword_set.classes:
+                    self.by_class.setdefault(keyword_set.classes[0], []).append(entry)
+                else:
+                    self.any_class.append(entry)
+        self.cache = {}
+
+    def match_window(self, wm_class, title):
+        best = None
+        candidates = list(self.any_class)
+        for name in window_class_names(wm_class):
+            candidates.extend(self.by_class.get(name, ()))
+        for priority, keyword_set in candidates:
+            if (best is None or priority < best) and keyword_set.matches(wm_class, title):
+                best = priority
+        return best
+
+    def match(self, windows):
+        """Index of the highest priority profile with a matching window, or None."""
+        cache = {}
+        best = None
+        for window in windows:
+            if window in self.cache:
+                result = self.cache[window]
+            else:
+                _, wm_class, title = window
+                result = self.match_window(wm_class, title)
+            cache[window] = result
+            if result is not None and (best is None or result < best):
+                best = result
+        self.cache = cache
+        return best
+
+    def match_any(self, windows):
+        return self.match(windows) is not None
+
+
+def compile_matcher(triggers):
+    return WindowMatcher(triggers)
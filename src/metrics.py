@@ -0,0 +1,128 @@
+import json
+import time
+import threading
+import itertools
+import contextlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "bigpicturetv_"
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DESCRIPTIONS = {
+    'ticks_total': ('counter', "Poll ticks run by the controller"),
+    'tick_duration_seconds': ('histogram', "Time spent in one poll tick"),
+    'forks_total': ('counter', "External commands started, by tool"),
+    'command_duration_seconds': ('histogram', "Run time of external commands, by tool"),
+    'command_failures_total': ('counter', "External commands that timed out, failed or are missing"),
+    'failures_total': ('counter', "Failures, by kind"),
+    'detection_latency_seconds': ('histogram', "Time from a detection change to the start of the switch"),
+    'switch_step_seconds': ('histogram', "Time from a detection change to the end of each switch step"),
+    'audio_migration_seconds': ('histogram', "Time taken to move the playing audio streams to the new sink"),
+    'transitions_total': ('counter', "Mode switches, by mode and result"),
+    'mode_active': ('gauge', "1 for the active mode"),
+    'span_duration_seconds': ('histogram', "Duration of traced spans"),
+}
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    values = ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels)
+    return '{' + values + '}'
+
+
+class Metrics:
+    """In-memory counters, gauges and histograms, read through the control socket.
+
+    Spans always feed span_duration_seconds; once tracing is enabled each
+    span is also appended to the trace file as a JSON line.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.trace_file = None
+        self.span_ids = itertools.count(1)
+        self.local = threading.local()
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.setdefault(key, [0] * len(BUCKETS) + [0, 0])
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def enable_tracing(self, path):
+        self.trace_file = open(path, 'a', buffering=1)
+        logger.info("Writing trace spans to %s", path)
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        stack = self.local.__dict__.setdefault('stack', [])
+        span_id = next(self.span_ids)
+        parent = stack[-1] if stack else None
+        stack.append(span_id)
+        started = time.time()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - start
+            stack.pop()
+            self.observe('span_duration_seconds', duration, span=name)
+            if self.trace_file:
+                record = {'name': name, 'id': span_id, 'parent': parent, 'start': started, 'duration_ms': round(duration * 1000, 3), 'thread': threading.current_thread().name, **attributes}
+                with self.lock:
+                    self.trace_file.write(json.dumps(record) + '\n')
+
+    def to_json(self):
+        with self.lock:
+            data = {}
+            for (name, labels), value in self.values.items():
+                data.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            for (name, labels), histogram in self.histograms.items():
+                data.setdefault(name, []).append({
+                    'labels': dict(labels),
+                    'buckets': dict(zip(map(str, BUCKETS), histogram)),
+                    'sum': histogram[-2],
+                    'count': histogram[-1],
+                })
+        return json.dumps(data, indent=4)
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            names = sorted({name for name, _ in self.values} | {name for name, _ in self.histograms})
+            for name in names:
+                metric_type, description = DESCRIPTIONS.get(name, ('untyped', name))
+                lines.append(f"# HELP {PREFIX}{name} {description}")
+                lines.append(f"# TYPE {PREFIX}{name} {metric_type}")
+                for (value_name, labels), value in sorted(self.values.items()):
+                    if value_name == name:
+                        lines.append(f"{PREFIX}{name}{format_labels(labels)} {value}")
+                for (histogram_name, labels), histogram in sorted(self.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    for bound, count in zip(BUCKETS, histogram):
+                        lines.append(f"{PREFIX}{name}_bucket{format_labels(labels + (('le', bound),))} {count}")
+                    lines.append(f"{PREFIX}{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram[-1]}")
+                    lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} {histogram[-2]}")
+                    lines.append(f"{PREFIX}{name}_count{format_labels(labels)} {histogram[-1]}")
+        return '\n'.join(lines)
+
+
+metrics = Metrics()
@@ -0,0 +1,108 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+DESKTOP = 'Desktop'
+PENDING_GAME = 'PendingGame'
+GAME = 'Game'
+PENDING_DESKTOP = 'PendingDesktop'
+SWITCHING = 'Switching'
+
+SWITCH = 'switch'
+CANCEL = 'cancel'
+
+
+class ModeStateMachine:
+    """Decides when a detection result is stable enough to switch modes.
+
+    Results are mode names, desktop_mode when nothing is detected. A new
+    result has to hold for its settle time (in seconds) before a switch
+    starts, so a title dropped for a moment does not flip the screens. While
+    a switch runs, results only update the target: the switch is cancelled
+    once a different result has settled, otherwise the controller checks the
+    target again when the switch is over.
+    """
+
+    def __init__(self, desktop_mode, game_settle_time, desktop_settle_time):
+        self.desktop_mode = desktop_mode
+        self.game_settle_time = game_settle_time
+        self.desktop_settle_time = desktop_settle_time
+        self.current = None
+        self.target = None
+        self.changed_at = None
+        self.switching = None
+        self.deferred = None
+        self.cancelled = None
+
+    def update(self, game_settle_time, desktop_settle_time):
+        self.game_settle_time = game_settle_time
+        self.desktop_settle_time = desktop_settle_time
+
+    @property
+    def state(self):
+        if self.switching is not None:
+            return SWITCHING
+        if self.target is not None and self.target != self.current:
+            return PENDING_DESKTOP if self.target == self.desktop_mode else PENDING_GAME
+        if self.current is None:
+            return None
+        return DESKTOP if self.current == self.desktop_mode else GAME
+
+    def deadline(self):
+        if self.target is None or self.target in (self.deferred, self.cancelled) or self.target == (self.current if self.switching is None else self.switching):
+            return None
+        return self.changed_at + (self.desktop_settle_time if self.target == self.desktop_mode else self.game_settle_time)
+
+    def timeout(self, now):
+        deadline = self.deadline()
+        return None if deadline is None else max(0, deadline - now)
+
+    def observe(self, target, current, now):
+        """Returns SWITCH, CANCEL or None for the latest detection result.
+
+        current is the active mode, None when no mode is known to be active.
+        """
+        self.current = current
+        if target != self.target:
+            previous_state = self.state
+            self.target = target
+            self.changed_at = now
+            self.deferred = None
+            if previous_state in (PENDING_GAME, PENDING_DESKTOP) and self.state != previous_state:
+                logger.info("Ignoring short lived change, staying in %s", self.state)
+
+        deadline = self.deadline()
+        if deadline is None:
+            return None
+        if self.switching is not None:
+            if now < deadline:
+                return None
+            # Nothing more to do until the cancelled switch is over.
+            self.cancelled = self.target
+            return CANCEL
+        if current is None or now >= deadline:
+            return SWITCH
+        return None
+
+    def hold(self, target, now):
+        """Takes target as settled, for modes requested outside of detection."""
+        self.target = target
+        self.changed_at = now
+        self.deferred = None
+
+    def defer(self, target):
+        """No deadline for target until resume(), its screen is not there yet."""
+        self.deferred = target
+
+    def resume(self):
+        self.deferred = None
+
+    def switch_started(self, mode):
+        self.switching = mode
+        self.deferred = None
+        self.cancelled = None
+
+    def switch_finished(self, current):
+        self.switching = None
+        self.cancelled = None
+        self.current = current
@@ -0,0 +1,250 @@
+import os
+import logging
+from display import create_display_backend, DisplayBackendError
+from metrics import metrics
+from commands import runner
+
+logger = logging.getLogger(__name__)
+
+SINK_TIMEOUT = 15
+GAME_MODE_NAME = "Game Mode"
+DESKTOP_MODE_NAME = "Desktop Mode"
+
+
+class Mode:
+    def __init__(self, display_backend, off_screen, audio, mode_name, screen_name, audio_backend, disable_audio=False, topology=None, keywords=None, stream_apps=None):
+        self.display_backend = display_backend
+        # None leaves playing streams where they are, an empty list moves them all.
+        self.stream_apps = stream_apps
+        self.keywords = keywords or []
+        self.topology = topology
+        self.off_screen = off_screen
+        self.audio = audio
+        self.audio_backend = audio_backend
+        self.mode_name = mode_name
+        self.screen_name = screen_name
+        self.current_mode = False
+        self.disable_audio = disable_audio
+
+    def activate(self, previous_mode=None):
+        logger.info("Activating mode: %s", self.mode_name)
+        self.switch_screen(previous_mode)
+        if not self.disable_audio:
+            self.switch_audio()
+        self.current_mode = True
+
+    def deactivate(self):
+        self.current_mode = False
+
+    def is_active(self):
+        return self.current_mode
+
+    def resolve_output(self, name):
+        if self.topology is None:
+            return name
+        return self.topology.resolve(name)
+
+    def is_available(self):
+        return self.resolve_output(self.screen_name) is not None
+
+    def prepare(self):
+        screen_name = self.resolve_output(self.screen_name)
+        if screen_name:
+            self.display_backend.prepare(screen_name)
+
+    def matches(self, active_outputs, default_sink):
+        """Whether the screens and audio already are as this mode leaves them."""
+        screen_name = self.resolve_output(self.screen_name)
+        off_screen = self.resolve_output(self.off_screen) or self.off_screen
+        if screen_name not in active_outputs or (off_screen != screen_name and off_screen in active_outputs):
+            return False
+        if self.disable_audio:
+            return True
+        return default_sink is not None and self.audio_backend.find_sink(self.audio) == default_sink
+
+    def get_off_screen(self, previous_mode):
+        # Leaving a profile turns its own screen off, whatever it was.
+        if previous_mode and previous_mode.screen_name != self.screen_name:
+            return previous_mode.screen_name
+        return self.off_screen
+
+    def switch_screen(self, previous_mode=None):
+        with metrics.span('switch_screen', mode=self.mode_name):
+            screen_name = self.resolve_output(self.screen_name)
+            if screen_name is None:
+                logger.warning("Not switching screen, %s is not connected", self.screen_name)
+                return
+            off_screen = self.get_off_screen(previous_mode)
+            logger.info("Switching screen to: %s", screen_name)
+            try:
+                self.display_backend.apply(screen_name, self.resolve_output(off_screen) or off_screen)
+            except DisplayBackendError as e:
+                logger.error(str(e))
+                metrics.increment('failures_total', kind='screen')
+
+    def switch_audio(self, cancelled=None):
+        with metrics.span('switch_audio', mode=self.mode_name):
+            node_name = self.audio_backend.wait_for_sink(self.audio, SINK_TIMEOUT, cancelled)
+            if cancelled and cancelled.is_set():
+                return
+            if node_name is None:
+                logger.warning(f"Audio output not found after {SINK_TIMEOUT}s: {self.audio}")
+                metrics.increment('failures_total', kind='audio')
+                return
+            logger.info(f"Switching audio to: {node_name}")
+            self.audio_backend.set_default_sink(node_name)
+            if self.stream_apps is not None:
+                self.audio_backend.move_streams(node_name, self.stream_apps)
+
+
+class SwitchPlan:
+    """Everything a transition needs, resolved once from the settings."""
+
+    def __init__(self, session_type, tools, display_backend, game_modes, desktopmode, display_options=None):
+        self.session_type = session_type
+        self.tools = tools
+        self.display_backend = display_backend
+        self.display_options = display_options
+        self.game_modes = game_modes
+        self.desktopmode = desktopmode
+        self.modes = game_modes + [desktopmode]
+        self.gamemode = self.find_mode(GAME_MODE_NAME)
+
+    def find_mode(self, mode_name):
+        for mode in self.modes:
+            if mode.mode_name == mode_name:
+                return mode
+        return None
+
+    def active_mode(self):
+        for mode in self.modes:
+            if mode.is_active():
+                return mode
+        return None
+
+
+class UnsupportedSessionError(Exception):
+    pass
+
+
+def get_session_type():
+    session_type = os.getenv("XDG_SESSION_TYPE", "").lower()
+
+    if session_type == "x11":
+        return "x11"
+    elif session_type == "wayland":
+        desktop_session = os.getenv("XDG_CURRENT_DESKTOP", "").lower()
+
+        if desktop_session in ["gnome", "ubuntu:gnome", "unity"]:
+            return "gnome-wayland"
+        elif desktop_session in ["kde", "plasma"]:
+            return "kde-wayland"
+        else:
+            return "unknown-wayland"
+
+    else:
+        return "Unsupported"
+
+
+def get_randr_command(session_type):
+    if session_type == "x11":
+        logger.info("Session type: X11. Using xrandr.")
+        return "xrandr"
+    elif session_type == "gnome-wayland":
+        logger.info("Session type: GNOME Wayland. Using gnome-randr.")
+        return "gnome-randr"
+    elif session_type == "kde-wayland":
+        logger.info("Session type: KDE Wayland. Using kscreen-doctor.")
+        return "kscreen-doctor"
+    else:
+        raise UnsupportedSessionError(f"Unsupported session type: {session_type}")
+
+
+def resolve_commands(commands):
+    tools = {}
+    for command in commands:
+        command_path = runner.which(command)
+        if command_path is None:
+            raise UnsupportedSessionError(f"The required command '{command}' is not installed or not executable.")
+        tools[command] = command_path
+    return tools
+
+
+def get_profiles(settings):
+    """Game mode profiles, highest priority first. The Big Picture profile wins ties."""
+    profiles = [{
+        "name": GAME_MODE_NAME,
+        "keywords": settings.bigPictureKeywords,
+        "adapter": settings.gamemodeAdapter,
+        "audio": settings.gamemodeAudio,
+        "priority": 0,
+    }] + list(settings.profiles)
+    profiles.sort(key=lambda profile: -profile["priority"])
+
+    unique_profiles = []
+    for profile in profiles:
+        if profile["name"] in [DESKTOP_MODE_NAME] + [other["name"] for other in unique_profiles]:
+            logger.warning("Ignoring profile with a duplicate name: %s", profile["name"])
+            continue
+        unique_profiles.append(profile)
+    return unique_profiles
+
+
+def build_switch_plan(settings, audio_backend, topology=None, previous=None):
+    session_type = get_session_type()
+    randr_command = get_randr_command(session_type)
+    commands = ['pactl', randr_command]
+    if settings.detectionStrategy == "window":
+        commands.append('wmctrl')
+    tools = resolve_commands(commands)
+    display_options = (session_type, tools[randr_command], settings.displayBackend == "auto")
+    if previous and previous.display_options == display_options:
+        # Kept across settings saves, the in-process backends hold a display server connection.
+        display_backend = previous.display_backend
+    else:
+        display_backend = create_display_backend(*display_options)
+    if topology:
+        topology.set_source(display_backend, session_type)
+
+    external_screen = settings.gamemodeAdapter
+    internal_screen = settings.desktopAdapter
+    disable_audio = settings.disableAudio
+    stream_apps = settings.moveAudioApps if settings.moveAudioStreams else None
+
+    logger.info(f"PARAM: audio switching: {not disable_audio}")
+    logger.info(f"PARAM: move playing audio: {stream_apps or settings.moveAudioStreams}")
+    logger.info(f"PARAM: window check rate (ms): {settings.checkRate}")
+    logger.info(f"PARAM: desktop screen: {internal_screen}")
+    logger.info(f"PARAM: desktop audio output: {settings.desktopAudio}")
+
+    game_modes = []
+    for profile in get_profiles(settings):
+        if profile["name"] == GAME_MODE_NAME and settings.detectionStrategy == "process":
+            detecting = "Steam process"
+        else:
+            detecting = profile["keywords"]
+        logger.info(f"PARAM: {profile['name']} (priority {profile['priority']}): detecting {detecting}, screen {profile['adapter']}, audio output {profile['audio']}")
+        game_modes.append(Mode(
+            display_backend,
+            internal_screen,
+            profile["audio"],
+            profile["name"],
+            profile["adapter"],
+            audio_backend,
+            disable_audio,
+            topology,
+            profile["keywords"],
+            stream_apps
+        ))
+    desktopmode = Mode(
+        display_backend,
+        external_screen,
+        settings.desktopAudio,
+        DESKTOP_MODE_NAME,
+        internal_screen,
+        audio_backend,
+        disable_audio,
+        topology,
+        stream_apps=stream_apps
+    )
+    return SwitchPlan(session_type, tools, display_backend, game_modes, desktopmode, display_options)
@@ -0,0 +1,158 @@
+import os
+import re
+import ctypes
+import select
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+STEAM_DIR = os.path.join(os.path.expanduser("~"), ".steam")
+STEAM_PID_FILE = os.path.join(STEAM_DIR, "steam.pid")
+STEAM_REGISTRY_FILE = os.path.join(STEAM_DIR, "registry.vdf")
+BIGPICTURE_ARGUMENTS = {'-gamepadui', '-bigpicture', '-tenfoot', '-steamos', '-steamdeck'}
+BIGPICTURE_REGISTRY_PATTERN = re.compile(r'"BigPictureInForeground"\s+"(\d+)"')
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+def read_steam_pid():
+    try:
+        with open(STEAM_PID_FILE) as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+    return pid if os.path.exists(f"/proc/{pid}") else None
+
+
+def read_cmdline(pid):
+    try:
+        with open(f"/proc/{pid}/cmdline", 'rb') as f:
+            return f.read().decode('utf-8', errors='replace').split('\0')
+    except OSError:
+        return []
+
+
+def read_registry_flag():
+    try:
+        with open(STEAM_REGISTRY_FILE, errors='replace') as f:
+            match = BIGPICTURE_REGISTRY_PATTERN.search(f.read())
+    except OSError:
+        return False
+    return bool(match) and match.group(1) != '0'
+
+
+class ProcessDetector:
+    """Detects Big Picture from the Steam process instead of window titles.
+
+    The Steam pid comes from ~/.steam/steam.pid. Big Picture is reported when
+    that process was started with a gamepad UI argument, or when Steam flags
+    BigPictureInForeground in registry.vdf. inotify on ~/.steam reports Steam
+    starting or writing its state, and a pidfd reports the process exiting,
+    so nothing in /proc is rescanned.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.active = None
+        self.pid = None
+        self.pidfd = None
+        self.exited_pid = None
+        self.inotify_fd = None
+        self.wake_pipe = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        if not os.path.isdir(STEAM_DIR):
+            logger.info("%s not found, Steam state will be polled.", STEAM_DIR)
+            return False
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.inotify_fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.inotify_fd < 0:
+            logger.warning("inotify unavailable, Steam state will be polled.")
+            self.inotify_fd = None
+            return False
+        if libc.inotify_add_watch(self.inotify_fd, STEAM_DIR.encode(), WATCH_MASK) < 0:
+            logger.warning("Cannot watch %s, Steam state will be polled.", STEAM_DIR)
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+            return False
+
+        self.wake_pipe = os.pipe()
+        self.thread = threading.Thread(target=self.watch, name='process-detector', daemon=True)
+        self.thread.start()
+        logger.info("Watching the Steam process for Big Picture.")
+        return True
+
+    def stop(self):
+        if self.wake_pipe:
+            os.write(self.wake_pipe[1], b'x')
+            self.thread.join()
+            for fd in self.wake_pipe:
+                os.close(fd)
+            self.wake_pipe = None
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+        self.follow_pid(None)
+        self.thread = None
+
+    def watch(self):
+        self.refresh()
+        while True:
+            fds = [self.inotify_fd, self.wake_pipe[0]]
+            if self.pidfd is not None:
+                fds.append(self.pidfd)
+            readable, _, _ = select.select(fds, [], [])
+            if self.wake_pipe[0] in readable:
+                return
+            if self.pidfd is not None and self.pidfd in readable:
+                # /proc/<pid> can outlive the process until it is reaped.
+                self.exited_pid = self.pid
+            if self.inotify_fd in readable:
+                try:
+                    os.read(self.inotify_fd, 65536)
+                except BlockingIOError:
+                    pass
+            self.refresh()
+
+    def follow_pid(self, pid):
+        if pid == self.pid:
+            return
+        if self.pidfd is not None:
+            os.close(self.pidfd)
+            self.pidfd = None
+        self.pid = pid
+        if pid is not None and hasattr(os, 'pidfd_open'):
+            try:
+                self.pidfd = os.pidfd_open(pid)
+            except OSError:
+                self.pidfd = None
+
+    def is_bigpicture_running(self):
+        pid = read_steam_pid()
+        if pid == self.exited_pid:
+            pid = None
+        self.follow_pid(pid)
+        if pid is None:
+            return False
+        if BIGPICTURE_ARGUMENTS.intersection(read_cmdline(pid)):
+            return True
+        return read_registry_flag()
+
+    def refresh(self):
+        with self.lock:
+            active = self.is_bigpicture_running()
+            if active == self.active:
+                return
+            self.active = active
+        self.callback(active)
@@ -0,0 +1,77 @@
+import json
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Recorder:
+    """Append-only JSONL log of what detection saw, for --replay.
+
+    Every line has a type and t, the seconds since the recording started.
+    Window lists are stored as deltas: windows added or renamed, and ids
+    removed since the previous list. Nothing is written until open() is
+    called, so the record_* calls cost nothing otherwise.
+    """
+
+    def __init__(self):
+        self.file = None
+        self.started = None
+        self.windows = {}
+        self.sinks = None
+        self.process_active = None
+        self.lock = threading.Lock()
+
+    def open(self, path):
+        self.file = open(path, 'a', buffering=1)
+        self.started = time.monotonic()
+        self.write({'type': 'start', 'time': time.time()})
+        logger.info("Recording detection events to %s", path)
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def write(self, record):
+        with self.lock:
+            if self.file:
+                self.file.write(json.dumps({'t': round(time.monotonic() - self.started, 3), **record}) + '\n')
+
+    def record_settings(self, settings):
+        if self.file:
+            self.write({'type': 'settings', 'settings': settings.to_dict()})
+
+    def record_windows(self, windows):
+        if not self.file:
+            return
+        current = {window[0]: window for window in windows}
+        added = [list(window) for window_id, window in current.items() if self.windows.get(window_id) != window]
+        removed = [window_id for window_id in self.windows if window_id not in current]
+        self.windows = current
+        if added or removed:
+            self.write({'type': 'windows', 'added': added, 'removed': removed})
+
+    def record_process(self, active):
+        if self.file and bool(active) != self.process_active:
+            self.process_active = bool(active)
+            self.write({'type': 'process', 'active': self.process_active})
+
+    def record_sinks(self, sinks):
+        if self.file and sinks != self.sinks:
+            self.sinks = dict(sinks)
+            self.write({'type': 'sinks', 'sinks': self.sinks})
+
+    def record_transition(self, transition):
+        if self.file:
+            self.write({
+                'type': 'transition',
+                'mode': transition.mode.mode_name,
+                'result': 'cancelled' if transition.cancelled.is_set() else 'done',
+                'timings': {step: round(elapsed, 3) for step, elapsed in transition.timings.items()},
+            })
+
+
+recorder = Recorder()
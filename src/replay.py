@@ -0,0 +1,156 @@
+import json
+import time
+import logging
+from settings import Settings
+from matcher import compile_matcher
+from modes import get_profiles, GAME_MODE_NAME, DESKTOP_MODE_NAME
+from mode_state import ModeStateMachine, SWITCH, CANCEL
+
+logger = logging.getLogger(__name__)
+
+MAX_STEPS_PER_EVENT = 100
+
+
+def load_recording(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class Replay:
+    """Feeds a recording through the matcher and the mode state machine.
+
+    Time is simulated, so a recording replays as fast as detection runs.
+    Switches take as long as the recorded ones did on average (instant if
+    none were recorded). Changes are seen as soon as they were recorded, as
+    with window events, polling delays are not simulated.
+    """
+
+    def __init__(self, records, settings=None):
+        self.records = records
+        self.fixed_settings = settings
+        self.settings = None
+        self.windows = {}
+        self.process_active = False
+        self.current = None
+        self.switching = None
+        self.switch_done_at = None
+        self.mode_state = None
+        self.matcher = None
+        self.profile_names = []
+        self.durations = self.get_durations(records)
+        self.switches = []
+        self.detections = 0
+        self.detection_time = 0
+
+    def get_durations(self, records):
+        samples = {}
+        for record in records:
+            if record['type'] == 'transition' and record['result'] == 'done':
+                timings = record['timings']
+                samples.setdefault(record['mode'], []).append(timings['total'] - timings.get('start', 0))
+        return {mode: sum(values) / len(values) for mode, values in samples.items()}
+
+    def apply_settings(self, settings):
+        self.settings = settings
+        profiles = get_profiles(settings)
+        self.profile_names = [profile["name"] for profile in profiles]
+        self.matcher = compile_matcher([profile["keywords"] for profile in profiles])
+        settle_times = (settings.gamemodeSettleTime / 1000, settings.desktopSettleTime / 1000)
+        if self.mode_state:
+            self.mode_state.update(*settle_times)
+        else:
+            self.mode_state = ModeStateMachine(DESKTOP_MODE_NAME, *settle_times)
+
+    def detect(self):
+        start = time.perf_counter()
+        if self.settings.detectionStrategy == "process":
+            mode = GAME_MODE_NAME if self.process_active else DESKTOP_MODE_NAME
+        else:
+            index = self.matcher.match(list(self.windows.values()))
+            mode = DESKTOP_MODE_NAME if index is None else self.profile_names[index]
+        self.detection_time += time.perf_counter() - start
+        self.detections += 1
+        return mode
+
+    def evaluate(self, now):
+        mode = self.detect()
+        action = self.mode_state.observe(mode, self.current, now)
+        if action == SWITCH:
+            self.switches.append({'t': round(now, 3), 'mode': mode, 'latency_ms': round((now - self.mode_state.changed_at) * 1000)})
+            self.current = None
+            self.switching = mode
+            self.switch_done_at = now + self.durations.get(mode, 0)
+            self.mode_state.switch_started(mode)
+        elif action == CANCEL:
+            self.switches[-1]['cancelled'] = True
+            self.switching = None
+            self.switch_done_at = now
+
+    def next_deadline(self):
+        deadlines = [deadline for deadline in (self.switch_done_at, self.mode_state.deadline()) if deadline is not None]
+        return min(deadlines) if deadlines else None
+
+    def advance(self, until):
+        for _ in range(MAX_STEPS_PER_EVENT):
+            deadline = self.next_deadline()
+            if deadline is None or deadline > until:
+                return
+            if self.switch_done_at is not None and self.switch_done_at <= deadline:
+                self.current = self.switching
+                self.switching = None
+                self.switch_done_at = None
+                self.mode_state.switch_finished(self.current)
+            self.evaluate(deadline)
+        logger.warning("Replay did not settle before t=%s", until)
+
+    def apply_record(self, record):
+        if record['type'] == 'settings' and self.fixed_settings is None:
+            self.apply_settings(Settings.from_dict(record['settings']))
+        elif record['type'] == 'windows':
+            for window_id in record['removed']:
+                self.windows.pop(window_id, None)
+            for window in record['added']:
+                self.windows[window[0]] = tuple(window)
+        elif record['type'] == 'process':
+            self.process_active = record['active']
+        else:
+            return False
+        return True
+
+    def run(self):
+        self.apply_settings(self.fixed_settings or Settings())
+        start = time.perf_counter()
+        end = 0
+        for record in self.records:
+            now = record['t']
+            self.advance(now)
+            if self.apply_record(record):
+                self.evaluate(now)
+            end = now
+        self.advance(float('inf'))
+        elapsed = time.perf_counter() - start
+
+        recorded = [record for record in self.records if record['type'] == 'transition']
+        return {
+            'recording_seconds': end,
+            'replay_seconds': round(elapsed, 3),
+            'records': len(self.records),
+            'detections': self.detections,
+            'detection_us_mean': round(self.detection_time / max(1, self.detections) * 1e6, 2),
+            'switches': self.switches,
+            # Recorded at the end of each switch, reported from when it started.
+            'recorded_switches': [
+                {'t': round(record['t'] - record['timings']['total'] + record['timings'].get('start', 0), 3), 'mode': record['mode'], 'result': record['result']}
+                for record in recorded
+            ],
+        }
+
+
+def main(path, settings_path=None):
+    settings = None
+    if settings_path:
+        with open(settings_path) as f:
+            settings = Settings.from_dict(json.load(f))
+    report = Replay(load_recording(path), settings).run()
+    print(json.dumps(report, indent=4))
+    return 0
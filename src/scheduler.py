@@ -0,0 +1,54 @@
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+BACKOFF_FACTOR = 2
+
+
+class AdaptiveScheduler:
+    """Poll deadline that starts at the floor after a trigger and backs off to the ceiling.
+
+    Intervals are in seconds. While paused there is no deadline at all.
+    """
+
+    def __init__(self, floor, ceiling):
+        self.floor = floor
+        self.ceiling = max(floor, ceiling)
+        self.interval = self.floor
+        self.deadline = time.monotonic()
+        self.pause_reasons = set()
+
+    def update(self, floor, ceiling):
+        self.floor = floor
+        self.ceiling = max(floor, ceiling)
+        self.trigger("settings changed")
+
+    def trigger(self, reason):
+        if self.interval != self.floor:
+            logger.debug("Polling faster: %s", reason)
+        self.interval = self.floor
+        self.deadline = min(self.deadline, time.monotonic() + self.floor)
+
+    def schedule(self):
+        self.deadline = time.monotonic() + self.interval
+        self.interval = min(self.ceiling, self.interval * BACKOFF_FACTOR)
+
+    def is_paused(self):
+        return bool(self.pause_reasons)
+
+    def pause(self, reason):
+        if not self.pause_reasons:
+            logger.info("Pausing detection: %s", reason)
+        self.pause_reasons.add(reason)
+
+    def resume(self, reason):
+        self.pause_reasons.discard(reason)
+        if not self.pause_reasons:
+            logger.info("Resuming detection after %s", reason)
+            self.trigger(reason)
+
+    def timeout(self):
+        if self.is_paused():
+            return None
+        return max(0, self.deadline - time.monotonic())
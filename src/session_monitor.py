@@ -0,0 +1,57 @@
+import os
+import re
+import threading
+import logging
+from commands import runner
+
+logger = logging.getLogger(__name__)
+
+SIGNAL_PATTERN = re.compile(r'\.(PrepareForSleep|ActiveChanged) \((true|false),\)')
+SIGNAL_EVENTS = {
+    'PrepareForSleep': 'suspend',
+    'ActiveChanged': 'screen lock',
+}
+
+
+def get_screensaver_name():
+    if 'gnome' in os.getenv("XDG_CURRENT_DESKTOP", "").lower():
+        return 'org.gnome.ScreenSaver'
+    return 'org.freedesktop.ScreenSaver'
+
+
+class SessionMonitor:
+    """Reports suspend and screen lock from logind and screensaver D-Bus signals.
+
+    The callback receives the event name ('suspend' or 'screen lock') and
+    whether it just started.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.processes = []
+
+    def start(self):
+        if runner.which('gdbus') is None:
+            logger.info("gdbus not found, detection will not pause on suspend or screen lock.")
+            return False
+
+        self.spawn(['gdbus', 'monitor', '--system', '--dest', 'org.freedesktop.login1', '--object-path', '/org/freedesktop/login1'])
+        self.spawn(['gdbus', 'monitor', '--session', '--dest', get_screensaver_name()])
+        return True
+
+    def stop(self):
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+        self.processes = []
+
+    def spawn(self, command):
+        process = runner.spawn(command)
+        self.processes.append(process)
+        threading.Thread(target=self.read_events, args=(process,), daemon=True).start()
+
+    def read_events(self, process):
+        for line in process.stdout:
+            match = SIGNAL_PATTERN.search(line)
+            if match:
+                self.callback(SIGNAL_EVENTS[match.group(1)], match.group(2) == 'true')
@@ -0,0 +1,157 @@
+import os
+import json
+import tempfile
+import threading
+import logging
+from dataclasses import dataclass, field, fields, asdict
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_PATH = os.path.join(os.path.expanduser("~"), ".config/BigPictureTV/settings.json")
+SAVE_DELAY = 0.5
+MIN_CHECK_RATE = 10
+PROFILE_DEFAULTS = {"name": "", "keywords": [], "adapter": "", "audio": "", "priority": 0}
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Validated settings, the field names are the keys used in settings.json."""
+
+    bigPictureKeywords: list = field(default_factory=lambda: ["Steam", "Big", "Picture", "mode"])
+    checkRate: int = 1000
+    idleCheckRate: int = 10000
+    gamemodeSettleTime: int = 500
+    desktopSettleTime: int = 2000
+    gamemodeAudio: str = ""
+    desktopAudio: str = ""
+    gamemodeAdapter: str = ""
+    desktopAdapter: str = ""
+    disableAudio: bool = True
+    moveAudioStreams: bool = True
+    moveAudioApps: list = field(default_factory=list)
+    displayBackend: str = "auto"
+    detectionStrategy: str = "window"
+    profiles: list = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data):
+        defaults = cls()
+        values = {}
+        for setting in fields(cls):
+            default = getattr(defaults, setting.name)
+            value = data.get(setting.name, default)
+            if not isinstance(value, type(default)) or (isinstance(value, bool) and not isinstance(default, bool)):
+                logger.warning("Ignoring invalid value for %s: %r", setting.name, value)
+                value = default
+            values[setting.name] = value
+
+        values["bigPictureKeywords"] = [str(keyword) for keyword in values["bigPictureKeywords"]]
+        values["moveAudioApps"] = [str(app) for app in values["moveAudioApps"]]
+        values["checkRate"] = max(MIN_CHECK_RATE, values["checkRate"])
+        values["idleCheckRate"] = max(values["checkRate"], values["idleCheckRate"])
+        values["gamemodeSettleTime"] = max(0, values["gamemodeSettleTime"])
+        values["desktopSettleTime"] = max(0, values["desktopSettleTime"])
+        if values["displayBackend"] not in ("auto", "command"):
+            logger.warning("Ignoring invalid value for displayBackend: %r", values["displayBackend"])
+            values["displayBackend"] = defaults.displayBackend
+        if values["detectionStrategy"] not in ("window", "process"):
+            logger.warning("Ignoring invalid value for detectionStrategy: %r", values["detectionStrategy"])
+            values["detectionStrategy"] = defaults.detectionStrategy
+        values["profiles"] = [profile for profile in map(validate_profile, values["profiles"]) if profile]
+        return cls(**values)
+
+    def to_dict(self):
+        return asdict(self)
+
+    def replace(self, **changes):
+        return Settings.from_dict({**self.to_dict(), **changes})
+
+
+def validate_profile(data):
+    if not isinstance(data, dict) or not isinstance(data.get("name"), str) or not data["name"]:
+        logger.warning("Ignoring profile without a name: %r", data)
+        return None
+    profile = {}
+    for key, default in PROFILE_DEFAULTS.items():
+        value = data.get(key, default)
+        if not isinstance(value, type(default)) or isinstance(value, bool):
+            logger.warning("Ignoring invalid value for %s in profile %s: %r", key, data["name"], value)
+            return None
+        profile[key] = value
+    profile["keywords"] = [str(keyword) for keyword in profile["keywords"]]
+    return profile
+
+
+def settings_exist():
+    return os.path.exists(SETTINGS_PATH)
+
+
+def load_settings():
+    if not settings_exist():
+        return Settings()
+    try:
+        with open(SETTINGS_PATH, 'r') as f:
+            return Settings.from_dict(json.load(f))
+    except (OSError, ValueError) as e:
+        logger.error("Cannot read %s, using defaults: %s", SETTINGS_PATH, e)
+        return Settings()
+
+
+def save_settings(settings):
+    directory = os.path.dirname(SETTINGS_PATH)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(prefix='.settings-', suffix='.json', dir=directory)
+    try:
+        with os.fdopen(descriptor, 'w') as f:
+            json.dump(settings.to_dict(), f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, SETTINGS_PATH)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+    directory_descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_descriptor)
+    finally:
+        os.close(directory_descriptor)
+    logger.info("Settings saved to %s", SETTINGS_PATH)
+
+
+class SettingsStore:
+    """Keeps the settings in memory and writes them once edits settle.
+
+    on_saved is called with the new Settings after each write, from the
+    timer thread.
+    """
+
+    def __init__(self, settings=None, on_saved=None, delay=SAVE_DELAY):
+        self.settings = settings or load_settings()
+        self.on_saved = on_saved
+        self.delay = delay
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def update(self, **changes):
+        with self.lock:
+            settings = self.settings.replace(**changes)
+            if settings == self.settings and self.timer is None:
+                return
+            self.settings = settings
+            if self.timer:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.timer is None:
+                return
+            self.timer.cancel()
+            self.timer = None
+            settings = self.settings
+            save_settings(settings)
+        if self.on_saved:
+            self.on_saved(settings)
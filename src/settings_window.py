@@ -0,0 +1,251 @@
+import os
+import sys
+import signal
+import logging
+from PyQt6.QtWidgets import QMainWindow, QApplication, QSystemTrayIcon, QMenu
+from PyQt6.QtGui import QIcon, QAction
+from PyQt6.QtCore import pyqtSignal, QObject, QTimer
+from design import Ui_MainWindow
+from controller import Controller
+from modes import UnsupportedSessionError
+from settings import SettingsStore, load_settings, save_settings, settings_exist
+import control
+
+logger = logging.getLogger(__name__)
+
+AUTOSTART_FILE = os.path.join(os.path.expanduser("~"), ".config/autostart/bigpicturetv.desktop")
+LAUNCHER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bigpicturetv.py")
+ICON_DESKTOP = "icons/icon_desktop.png"
+ICON_GAMEMODE = "icons/icon_gamemode.png"
+
+class Communicator(QObject):
+    detection_status_changed = pyqtSignal(bool)
+    controller_state_changed = pyqtSignal()
+    settings_requested = pyqtSignal()
+    quit_requested = pyqtSignal()
+
+class SettingsWindow(QMainWindow):
+    def __init__(self, controller=None):
+        super().__init__()
+        self.ui = Ui_MainWindow()
+        self.ui.setupUi(self)
+        self.setWindowTitle("BigPictureTV - Settings")
+        self.setFixedSize(self.size())
+        self.controller = controller
+        first_run = not settings_exist()
+        self.settings_store = SettingsStore(on_saved=self.on_settings_saved)
+        self.apply_settings()
+        self.init_ui_connections()
+        if first_run:
+            self.show()
+            save_settings(self.settings_store.settings)
+
+        self.communicator = Communicator()
+        self.communicator.detection_status_changed.connect(self.update_detection_status)
+        self.communicator.controller_state_changed.connect(self.update_tray_menu)
+        self.communicator.settings_requested.connect(self.show)
+        self.communicator.quit_requested.connect(QApplication.quit)
+
+        if self.controller:
+            self.icons = {
+                'Desktop Mode': QIcon(ICON_DESKTOP),
+                'Game Mode': QIcon(ICON_GAMEMODE),
+            }
+            self.tray_state = None
+            self.tray_icon = self.create_tray_icon()
+            self.controller.add_listener(self.communicator.controller_state_changed.emit)
+
+    def update_detection_status(self, status):
+        # The tray follows once the controller has applied it.
+        self.controller.set_detection_active(status)
+
+    def create_tray_icon(self):
+        tray_icon = QSystemTrayIcon(self)
+        tray_icon.setIcon(self.icons['Desktop Mode'])
+        tray_icon.setContextMenu(self.create_menu())
+        tray_icon.show()
+        return tray_icon
+
+    def create_menu(self):
+        menu = QMenu()
+
+        self.current_mode_action = QAction('Current Mode: Unknown', menu)
+        self.current_mode_action.setEnabled(False)
+        menu.addAction(self.current_mode_action)
+
+        self.detection_status = QAction('Detection State: Active', menu)
+        self.detection_status.setEnabled(False)
+        menu.addAction(self.detection_status)
+
+        menu.addSeparator()
+
+        self.pause_resume_action = QAction('Pause Detection', menu)
+        self.pause_resume_action.triggered.connect(self.toggle_detection)
+        menu.addAction(self.pause_resume_action)
+
+        settings_action = QAction('Settings', menu)
+        settings_action.triggered.connect(self.show)
+        menu.addAction(settings_action)
+
+        exit_action = QAction('Exit', menu)
+        exit_action.triggered.connect(QApplication.quit)
+        menu.addAction(exit_action)
+
+        return menu
+
+    def update_tray_menu(self):
+        # Every change is pushed to the panel over D-Bus, only send what differs.
+        current_mode = self.controller.current_mode()
+        detection_active = self.controller.detection_active
+        state = (current_mode, detection_active)
+        if state == self.tray_state:
+            return
+        previous_mode, previous_active = self.tray_state or (False, None)
+        self.tray_state = state
+
+        if detection_active != previous_active:
+            if detection_active:
+                self.pause_resume_action.setText('Pause Detection')
+                self.detection_status.setText('Detection State: Active')
+            else:
+                self.pause_resume_action.setText('Resume Detection')
+                self.detection_status.setText('Detection State: Paused')
+
+        if current_mode != previous_mode:
+            self.current_mode_action.setText(f"Current Mode: {current_mode or 'Unknown'}")
+            if current_mode:
+                # Every profile other than the desktop shows the game mode icon.
+                self.tray_icon.setIcon(self.icons.get(current_mode, self.icons['Game Mode']))
+
+    def toggle_detection(self):
+        self.communicator.detection_status_changed.emit(not self.controller.detection_active)
+
+    def closeEvent(self, event):
+        if self.controller:
+            event.ignore()
+            self.hide()
+        else:
+            event.accept()
+
+    def init_ui_connections(self):
+        self.ui.checkRate.valueChanged.connect(self.save_settings)
+        self.ui.gamemodeAudio.textChanged.connect(self.save_settings)
+        self.ui.desktopAudio.textChanged.connect(self.save_settings)
+        self.ui.gamemodeAdapter.textChanged.connect(self.save_settings)
+        self.ui.desktopAdapter.textChanged.connect(self.save_settings)
+        self.ui.disableAudiobox.stateChanged.connect(self.on_disableAudioBox_stateChanged)
+        self.ui.bigPictureKeywords.textChanged.connect(self.save_settings)
+        self.ui.startupBox.stateChanged.connect(self.on_startUpBox_stateChanged)
+
+    def toggle_audio_settings(self, state):
+        self.ui.gamemodeAudio.setEnabled(not state)
+        self.ui.desktopAudio.setEnabled(not state)
+        self.ui.desktopAudioLabel.setEnabled(not state)
+        self.ui.gamemodeAudioLabel.setEnabled(not state)
+
+    def on_disableAudioBox_stateChanged(self):
+        self.toggle_audio_settings(self.ui.disableAudiobox.isChecked())
+        self.save_settings()
+
+    def on_startUpBox_stateChanged(self):
+        autostart_dir = os.path.dirname(AUTOSTART_FILE)
+        script_folder = os.path.dirname(LAUNCHER)
+        exec_cmd = f"{LAUNCHER}"
+        if self.ui.startupBox.isChecked():
+            os.makedirs(autostart_dir, exist_ok=True)
+
+            with open(AUTOSTART_FILE, 'w') as f:
+                f.write("[Desktop Entry]\n")
+                f.write("Type=Application\n")
+                f.write("Name=BigPictureTV\n")
+                f.write(f"Path={script_folder}\n")
+                f.write(f"Exec={exec_cmd}\n")
+                logger.info("Autostart enabled.")
+        else:
+            if os.path.exists(AUTOSTART_FILE):
+                os.remove(AUTOSTART_FILE)
+                logger.info("Autostart disabled.")
+
+    def apply_settings(self):
+        settings = self.settings_store.settings
+        self.ui.bigPictureKeywords.setText(' '.join(settings.bigPictureKeywords))
+        self.ui.checkRate.setValue(settings.checkRate)
+        self.ui.gamemodeAudio.setText(settings.gamemodeAudio)
+        self.ui.desktopAudio.setText(settings.desktopAudio)
+        self.ui.gamemodeAdapter.setText(settings.gamemodeAdapter)
+        self.ui.desktopAdapter.setText(settings.desktopAdapter)
+        self.ui.disableAudiobox.setChecked(settings.disableAudio)
+        self.toggle_audio_settings(self.ui.disableAudiobox.isChecked())
+
+        self.ui.startupBox.setChecked(os.path.exists(AUTOSTART_FILE))
+
+    def collect_settings(self):
+        return {
+            "bigPictureKeywords": self.ui.bigPictureKeywords.text().split(),
+            "checkRate": self.ui.checkRate.value(),
+            "gamemodeAudio": self.ui.gamemodeAudio.text(),
+            "desktopAudio": self.ui.desktopAudio.text(),
+            "gamemodeAdapter": self.ui.gamemodeAdapter.text(),
+            "desktopAdapter": self.ui.desktopAdapter.text(),
+            "disableAudio": self.ui.disableAudiobox.isChecked()
+        }
+
+    def save_settings(self):
+        # Written to disk and handed to detection once edits settle.
+        self.settings_store.update(**self.collect_settings())
+
+    def on_settings_saved(self, settings):
+        if self.controller:
+            self.controller.update_settings(settings)
+        else:
+            try:
+                control.send_command('reload')
+            except OSError:
+                # No daemon running, it will read the file when it starts.
+                pass
+
+def run_tray():
+    server = control.ControlServer()
+    try:
+        server.acquire()
+    except control.AlreadyRunningError:
+        # A second launch opens the settings of the running instance.
+        try:
+            control.send_command('settings')
+        except OSError as e:
+            logger.error("BigPictureTV is already running but does not answer: %s", e)
+            return 1
+        return 0
+    except OSError as e:
+        logger.error("Cannot create the control socket: %s", e)
+        return 1
+
+    app = QApplication(sys.argv)
+    controller = Controller(load_settings())
+    window = SettingsWindow(controller)
+    try:
+        controller.start()
+    except UnsupportedSessionError as e:
+        logger.error(str(e))
+        server.stop()
+        sys.exit(1)
+    server.handler = control.CommandHandler(controller, window.communicator.settings_requested.emit, window.communicator.quit_requested.emit)
+    server.start()
+    app.aboutToQuit.connect(window.settings_store.flush)
+    app.aboutToQuit.connect(server.stop)
+    app.aboutToQuit.connect(controller.shutdown)
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: app.quit())
+    # Python only runs signal handlers between bytecodes, wake it up now and then.
+    signal_timer = QTimer()
+    signal_timer.timeout.connect(lambda: None)
+    signal_timer.start(500)
+    return app.exec()
+
+def run_settings():
+    app = QApplication(sys.argv)
+    window = SettingsWindow()
+    window.show()
+    app.aboutToQuit.connect(window.settings_store.flush)
+    return app.exec()
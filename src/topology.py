@@ -0,0 +1,161 @@
+import os
+import glob
+import json
+import threading
+import logging
+from commands import runner
+
+logger = logging.getLogger(__name__)
+
+DRM_SYSFS = "/sys/class/drm"
+KNOWN_OUTPUTS_PATH = os.path.join(os.path.expanduser("~"), ".cache/BigPictureTV/outputs.json")
+
+
+class Output:
+    def __init__(self, name, connected, identity=None):
+        self.name = name
+        self.connected = connected
+        self.identity = identity
+
+    def __eq__(self, other):
+        return isinstance(other, Output) and (self.name, self.connected, self.identity) == (other.name, other.connected, other.identity)
+
+    def __repr__(self):
+        return f"Output({self.name!r}, connected={self.connected}, identity={self.identity!r})"
+
+
+def edid_identity(edid):
+    if len(edid) < 128 or edid[:8] != b'\x00\xff\xff\xff\xff\xff\xff\x00':
+        return None
+    vendor = (edid[8] << 8) | edid[9]
+    manufacturer = ''.join(chr(((vendor >> shift) & 0x1f) + ord('A') - 1) for shift in (10, 5, 0))
+    product = edid[10] | (edid[11] << 8)
+    serial = edid[12] | (edid[13] << 8) | (edid[14] << 16) | (edid[15] << 24)
+
+    name = ''
+    for offset in range(54, 126, 18):
+        descriptor = edid[offset:offset + 18]
+        # Display product name descriptor
+        if descriptor[:3] == b'\x00\x00\x00' and descriptor[3] == 0xfc:
+            name = descriptor[5:].split(b'\n')[0].decode('ascii', errors='replace').strip()
+    return f"{manufacturer}-{product:04x}-{serial:08x}-{name}"
+
+
+def read_drm_outputs():
+    outputs = {}
+    for path in sorted(glob.glob(os.path.join(DRM_SYSFS, "card*-*"))):
+        name = os.path.basename(path).split('-', 1)[1]
+        try:
+            with open(os.path.join(path, "status")) as f:
+                connected = f.read().strip() == "connected"
+            with open(os.path.join(path, "edid"), 'rb') as f:
+                identity = edid_identity(f.read())
+        except OSError:
+            continue
+        # With several GPUs the same connector name shows up on each card,
+        # the one with a screen plugged in is the one the tools will use.
+        if name in outputs and outputs[name].connected and not connected:
+            continue
+        outputs[name] = Output(name, connected, identity)
+    return outputs
+
+
+class TopologyCache:
+    """Connected outputs, read once and refreshed on DRM hotplug events.
+
+    Outputs come from the display backend when it can list them (so names
+    match what it expects). DRM sysfs is only a fallback on Wayland, where
+    the compositors use the kernel connector names; X drivers name their
+    outputs differently, so on X11 nothing is listed and every switch is
+    attempted. The EDID identity
+    last seen on each configured connector is remembered, so a TV moved to
+    another port is still found. Unknown names are never reported missing,
+    the switch is just attempted as before.
+    """
+
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        self.source = None
+        self.session_type = None
+        self.outputs = {}
+        self.known_outputs = self.load_known_outputs()
+        self.monitor = None
+        self.lock = threading.Lock()
+
+    def set_source(self, source, session_type):
+        self.source = source if hasattr(source, 'list_outputs') else None
+        self.session_type = session_type
+        self.refresh()
+
+    def start(self):
+        self.refresh()
+        if runner.which('udevadm') is None:
+            logger.info("udevadm not found, display hotplug will not be followed.")
+            return False
+        self.monitor = runner.spawn(['udevadm', 'monitor', '--udev', '--subsystem-match=drm'])
+        threading.Thread(target=self.read_events, args=(self.monitor,), daemon=True).start()
+        return True
+
+    def stop(self):
+        if self.monitor and self.monitor.poll() is None:
+            self.monitor.terminate()
+        self.monitor = None
+
+    def read_events(self, process):
+        for line in process.stdout:
+            if 'change' in line:
+                self.refresh()
+
+    def list_outputs(self):
+        outputs = self.source.list_outputs() if self.source else None
+        if outputs is None and self.session_type and self.session_type.endswith('wayland'):
+            outputs = read_drm_outputs()
+        return outputs or {}
+
+    def refresh(self):
+        outputs = self.list_outputs()
+        with self.lock:
+            if outputs == self.outputs:
+                return
+            self.outputs = outputs
+        logger.info("Connected outputs: %s", ', '.join(name for name, output in outputs.items() if output.connected) or 'none')
+        if self.on_change:
+            self.on_change()
+
+    def load_known_outputs(self):
+        try:
+            with open(KNOWN_OUTPUTS_PATH) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def remember(self, name, identity):
+        if self.known_outputs.get(name) == identity:
+            return
+        self.known_outputs[name] = identity
+        try:
+            os.makedirs(os.path.dirname(KNOWN_OUTPUTS_PATH), exist_ok=True)
+            with open(KNOWN_OUTPUTS_PATH, 'w') as f:
+                json.dump(self.known_outputs, f, indent=4)
+        except OSError as e:
+            logger.warning("Cannot save %s: %s", KNOWN_OUTPUTS_PATH, e)
+
+    def resolve(self, name):
+        """Connector to use for a configured output name, or None when it is absent."""
+        with self.lock:
+            outputs = self.outputs
+        output = outputs.get(name)
+        if output and output.connected:
+            if output.identity:
+                self.remember(name, output.identity)
+            return name
+
+        identity = self.known_outputs.get(name)
+        if identity:
+            for other in outputs.values():
+                if other.connected and other.identity == identity:
+                    logger.info("%s found on %s", name, other.name)
+                    return other.name
+            return None
+        # Never seen connected: only report it missing if the name is known to be unplugged.
+        return None if output else name
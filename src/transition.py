@@ -0,0 +1,100 @@
+import time
+import threading
+import logging
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Transition:
+    def __init__(self, mode, previous_mode, detected_at):
+        self.mode = mode
+        self.previous_mode = previous_mode
+        self.detected_at = detected_at
+        self.timings = {}
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+
+    def cancel(self):
+        if not self.done.is_set() and not self.cancelled.is_set():
+            logger.info("Cancelling transition to %s", self.mode.mode_name)
+            self.cancelled.set()
+            self.mode.audio_backend.wake()
+
+    def is_running(self):
+        return not self.done.is_set()
+
+    def mark(self, step):
+        self.timings[step] = time.monotonic() - self.detected_at
+
+    def summary(self):
+        steps = ', '.join(f"{step} {elapsed * 1000:.0f}ms" for step, elapsed in self.timings.items())
+        state = "cancelled" if self.cancelled.is_set() else "done"
+        return f"Transition to {self.mode.mode_name} {state}: {steps}"
+
+
+class TransitionRunner:
+    """Runs mode switches off the GUI thread.
+
+    The screen and audio steps run side by side: the audio step waits for its
+    sink to show up, which covers HDMI sinks that only appear once the screen
+    switch has enabled the output. Steps run on daemon threads, a screen tool
+    stuck past the shutdown budget must not keep the process alive.
+    """
+
+    def __init__(self, on_finished):
+        self.on_finished = on_finished
+        self.current = None
+
+    def is_running(self):
+        return self.current is not None and self.current.is_running()
+
+    def start(self, mode, previous_mode, detected_at=None):
+        transition = Transition(mode, previous_mode, detected_at or time.monotonic())
+        self.current = transition
+        threading.Thread(target=self.run, args=(transition,), name='transition', daemon=True).start()
+        return transition
+
+    def run(self, transition):
+        mode = transition.mode
+        logger.info("Activating mode: %s", mode.mode_name)
+        transition.mark('start')
+        try:
+            errors = []
+            screen = threading.Thread(target=self.run_screen_step, args=(transition, errors), name='transition-screen', daemon=True)
+            screen.start()
+            if not mode.disable_audio:
+                self.run_step(transition, 'audio', lambda: mode.switch_audio(transition.cancelled))
+            screen.join()
+            if errors:
+                raise errors[0]
+        except Exception:
+            logger.exception("Transition to %s failed", mode.mode_name)
+            metrics.increment('failures_total', kind='transition')
+            transition.cancelled.set()
+        finally:
+            transition.mark('total')
+            transition.done.set()
+            logger.info(transition.summary())
+            metrics.increment('transitions_total', mode=mode.mode_name, result='cancelled' if transition.cancelled.is_set() else 'done')
+            self.on_finished(transition)
+
+    def run_screen_step(self, transition, errors):
+        try:
+            self.run_step(transition, 'screen', lambda: transition.mode.switch_screen(transition.previous_mode))
+        except Exception as e:
+            errors.append(e)
+
+    def run_step(self, transition, step, function):
+        if transition.cancelled.is_set():
+            return
+        function()
+        if not transition.cancelled.is_set():
+            transition.mark(step)
+
+    def shutdown(self, timeout=None):
+        if self.current:
+            self.current.cancel()
+            # A screen tool already running cannot be interrupted, but is not waited on forever.
+            if not self.current.done.wait(timeout):
+                logger.warning("Transition to %s still running at shutdown", self.current.mode.mode_name)
@@ -0,0 +1,101 @@
+import os
+import re
+import threading
+import logging
+from commands import runner, CommandError
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_WINDOW_PATTERN = re.compile(r'_NET_ACTIVE_WINDOW\(WINDOW\): window id # (0x[0-9a-fA-F]+)')
+
+
+def list_windows():
+    try:
+        output = runner.run(['wmctrl', '-lx'], retries=1)
+    except CommandError as e:
+        logger.warning("Cannot list windows: %s", e)
+        return []
+    windows = []
+    for line in output.splitlines():
+        parts = line.split(None, 4)
+        if len(parts) == 5:
+            windows.append((parts[0], parts[2], parts[4]))
+    return windows
+
+
+class WindowWatcher:
+    """Reports the window list whenever the window manager signals a change.
+
+    xprop -spy stays attached to the root window and prints a line on every
+    _NET_CLIENT_LIST / _NET_ACTIVE_WINDOW PropertyNotify, and a second spy
+    follows _NET_WM_NAME on the active window. Steam runs as an X client on
+    Wayland sessions too, so the same events are available through XWayland.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.windows = None
+        self.root_spy = None
+        self.title_spy = None
+        self.active_window = None
+        self.lock = threading.Lock()
+
+    def is_available(self):
+        return bool(os.getenv("DISPLAY")) and runner.which('xprop') is not None and runner.which('wmctrl') is not None
+
+    def is_running(self):
+        return self.root_spy is not None and self.root_spy.poll() is None
+
+    def start(self):
+        if not self.is_available():
+            logger.info("Window events unavailable (no DISPLAY or xprop), falling back to polling.")
+            return False
+
+        self.root_spy = self.spawn_spy(['-root', '_NET_CLIENT_LIST', '_NET_ACTIVE_WINDOW'])
+        threading.Thread(target=self.read_root_events, args=(self.root_spy,), daemon=True).start()
+        logger.info("Watching window manager events.")
+        return True
+
+    def stop(self):
+        for process in (self.root_spy, self.title_spy):
+            if process and process.poll() is None:
+                process.terminate()
+        self.root_spy = None
+        self.title_spy = None
+
+    def spawn_spy(self, args):
+        return runner.spawn(['xprop', '-spy'] + args)
+
+    def read_root_events(self, process):
+        for line in process.stdout:
+            match = ACTIVE_WINDOW_PATTERN.search(line)
+            if match:
+                self.follow_active_window(match.group(1))
+            self.refresh()
+        if process is self.root_spy:
+            logger.warning("Window event watcher exited, falling back to polling.")
+            self.root_spy = None
+
+    def read_title_events(self, process):
+        for _ in process.stdout:
+            self.refresh()
+
+    def follow_active_window(self, window_id):
+        if window_id == self.active_window:
+            return
+        self.active_window = window_id
+        if self.title_spy and self.title_spy.poll() is None:
+            self.title_spy.terminate()
+        self.title_spy = None
+        if int(window_id, 16) == 0:
+            return
+        self.title_spy = self.spawn_spy(['-id', window_id, '_NET_WM_NAME'])
+        threading.Thread(target=self.read_title_events, args=(self.title_spy,), daemon=True).start()
+
+    def refresh(self):
+        with self.lock:
+            windows = list_windows()
+            if windows == self.windows:
+                return
+            self.windows = windows
+        self.callback(windows)